@@ -1,23 +1,534 @@
-import cv2
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.applications import EfficientNetB4
-from tensorflow.keras.models import load_model
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, BatchNormalization
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
 import os
 import logging
 import json
+import threading
+import time
+import hashlib
+from collections.abc import Mapping
+import metrics
+from batching import BatcherStoppedError, InferenceBatcher
+from inference_backends import EnsembleBackend, KerasBackend, create_backend, load_backend
+from lazy_imports import LazyModule
+from result_cache import ResultCache
+
+# TensorFlow and OpenCV take seconds to import, so defer them until an image is
+# actually processed; the server can answer health checks and lookups before that
+cv2 = LazyModule("cv2")
+tf = LazyModule("tensorflow")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL_PATH = 'models/eye_disease_model.h5'
+DEFAULT_CONFIG_PATH = 'config/model_config.json'
+
+def load_config(config_path):
+    """
+    Load model configuration from JSON file, falling back to defaults
+    
+    Args:
+        config_path: Path to model configuration file
+        
+    Returns:
+        Configuration dictionary
+    """
+    try:
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+            logger.info(f"Configuration loaded from {config_path}")
+        else:
+            # Default configuration
+            config = {
+                "input_size": [224, 224],
+                "normalization_method": "per_image",
+                "confidence_threshold": 0.5,
+                "ensemble_models": False,
+                "ensemble": {
+                    "checkpoints": [],
+                    "augmentations": ["identity", "hflip", "vflip", "rot180"],
+                    "max_passes": 8,
+                    "max_std": 0.1
+                },
+                "batching": {
+                    "max_batch_size": 16,
+                    "max_wait_ms": 10
+                },
+                "pipeline": {
+                    "workers": 0
+                },
+                "streaming": {
+                    "batch_size": 8,
+                    "frame_step": 1,
+                    "max_frames": 600
+                },
+                "quality_gate": {
+                    "enabled": True,
+                    "thumbnail_size": 128,
+                    "min_sharpness": 50.0,
+                    "tile_sharpness": 100.0,
+                    "min_focus_coverage": 0.4,
+                    "min_brightness": 25.0,
+                    "max_brightness": 235.0,
+                    "max_saturated_fraction": 0.25,
+                    "fov_threshold": 20,
+                    "min_field_of_view": 0.25
+                },
+                "inference_backend": {
+                    "type": "keras",
+                    "path": None,
+                    "num_threads": None
+                },
+                "result_cache": {
+                    "enabled": True,
+                    "max_memory_mb": 64,
+                    "disk_dir": None,
+                    "max_disk_mb": 512
+                },
+                "preprocessing": {
+                    "mode": "full",
+                    "working_size": 448,
+                    "clahe_clip_limit": 2.0,
+                    "clahe_grid_size": [8, 8],
+                    "denoise_strength": 10,
+                    "gamma_correction": 1.2
+                }
+            }
+            logger.warning(f"No configuration found at {config_path}. Using defaults.")
+    except Exception as e:
+        logger.error(f"Error loading configuration: {str(e)}. Using defaults.")
+        config = {"input_size": [224, 224], "normalization_method": "per_image"}
+    
+    return config
+
+# Preprocessing is kept at module level so worker processes can run it
+# without constructing a detector (and loading the model)
+def _image_dimensions(data):
+    """
+    Read (height, width) from a JPEG or PNG header without decoding the image
+    
+    Args:
+        data: Encoded image bytes
+        
+    Returns:
+        (height, width) tuple, or None if the format is not recognized
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return int.from_bytes(data[20:24], 'big'), int.from_bytes(data[16:20], 'big')
+    
+    if data[:2] != b'\xff\xd8':
+        return None
+    
+    # Walk JPEG segments until the start-of-frame marker that holds the dimensions
+    offset = 2
+    while offset + 9 < len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return (int.from_bytes(data[offset + 5:offset + 7], 'big'),
+                    int.from_bytes(data[offset + 7:offset + 9], 'big'))
+        offset += 2 + int.from_bytes(data[offset + 2:offset + 4], 'big')
+    return None
+
+def _reduced_decode_flag(height, width, working_size):
+    """Pick the largest IMREAD_REDUCED_* factor that keeps the short side at or above working_size"""
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                         (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if min(height, width) // factor >= working_size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+def _read_file_bytes(image_path):
+    """Read a file's bytes, returning None if it cannot be read"""
+    try:
+        with open(image_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def load_image(image_path, config):
+    """
+    Read an image from disk for analysis
+    
+    In "fast" preprocessing mode, large JPEGs are decoded directly at a
+    reduced resolution close to the working size instead of at full size.
+    
+    Args:
+        image_path: Path to the image file
+        config: Model configuration dictionary
+        
+    Returns:
+        (image in BGR format or None if unreadable, original (height, width, channels))
+    """
+    preprocessing = config.get("preprocessing", {})
+    if preprocessing.get("mode", "full") != "fast":
+        img = cv2.imread(image_path)
+        return img, (img.shape if img is not None else None)
+    
+    data = _read_file_bytes(image_path)
+    if data is None:
+        return None, None
+    return decode_image_bytes(data, config)
+
+def decode_image_bytes(data, config):
+    """
+    Decode an encoded image (JPEG, PNG, ...) held in memory
+    
+    Args:
+        data: Encoded image as bytes, bytearray, memoryview or 1-D uint8 array
+        config: Model configuration dictionary
+        
+    Returns:
+        (image in BGR format or None if undecodable, original (height, width, channels))
+    """
+    if isinstance(data, np.ndarray):
+        # Header parsing works on byte views, not NumPy element comparisons
+        data = memoryview(np.ascontiguousarray(data, dtype=np.uint8)).cast('B')
+    
+    preprocessing = config.get("preprocessing", {})
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    
+    dimensions = _image_dimensions(data) if preprocessing.get("mode", "full") == "fast" else None
+    if dimensions is None:
+        img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        return img, (img.shape if img is not None else None)
+    
+    flag = _reduced_decode_flag(dimensions[0], dimensions[1], preprocessing.get("working_size", 448))
+    img = cv2.imdecode(buffer, flag)
+    if img is None:
+        return None, None
+    
+    # imdecode applies the EXIF orientation but the header holds the stored dimensions:
+    # swap them when the decoded image's aspect matches them transposed, as full mode reports
+    height, width = dimensions
+    decoded_height, decoded_width = img.shape[:2]
+    if abs(width * decoded_width - height * decoded_height) < abs(height * decoded_width - width * decoded_height):
+        height, width = width, height
+    return img, (height, width, img.shape[2])
+
+def _is_decoded_image(source):
+    """True if the source is an already decoded image rather than a path or encoded bytes"""
+    return isinstance(source, np.ndarray) and source.ndim in (2, 3) and source.dtype == np.uint8
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+def load_image_source(source, config):
+    """
+    Load an image for analysis from any supported source
+    
+    Args:
+        source: File path, encoded image bytes (bytes, bytearray, memoryview or
+            1-D uint8 array) or an already decoded BGR image array
+        config: Model configuration dictionary
+        
+    Returns:
+        (image in BGR format or None if unreadable, original (height, width, channels))
+    """
+    if _is_decoded_image(source):
+        img = source if source.ndim == 3 else cv2.cvtColor(source, cv2.COLOR_GRAY2BGR)
+        return img, img.shape
+    if _is_path(source):
+        return load_image(source, config)
+    return decode_image_bytes(source, config)
+
+def split_named_source(item):
+    """Split a batch item into (name, source); a bare file path names itself"""
+    if isinstance(item, tuple):
+        return item
+    return item, item
+
+def _resize_to_working_size(image, working_size):
+    """Downscale an image so its short side is working_size (never upscales)"""
+    height, width = image.shape[:2]
+    scale = working_size / min(height, width)
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+# User-facing advice for each reason an image can fail the quality gate
+QUALITY_GUIDANCE = {
+    "blurry": "The image is out of focus. Hold the camera steady and let it focus on the eye before capturing.",
+    "too_dark": "The image is too dark. Retake it with more light or the camera flash enabled.",
+    "overexposed": "The image is overexposed. Reduce glare or move away from direct light.",
+    "field_of_view": "The eye does not fill enough of the frame. Move closer and center the eye.",
+}
+
+def quality_gate_enabled(config):
+    return config.get("quality_gate", {}).get("enabled", True)
+
+def assess_image_quality(image, config):
+    """
+    Check whether an image is sharp, well exposed and framed well enough to analyze
+    
+    Runs on a small grayscale thumbnail with plain NumPy array operations, so
+    it costs a few milliseconds even for full-resolution photos.
+    
+    Args:
+        image: Decoded BGR (or grayscale) image
+        config: Model configuration dictionary (thresholds come from config["quality_gate"])
+        
+    Returns:
+        Dictionary with "acceptable", the list of "issues" and the measurements behind them
+    """
+    gate = config.get("quality_gate", {})
+    thumbnail_size = gate.get("thumbnail_size", 128)
+    
+    # Strided view down to about twice the thumbnail size first, so large photos
+    # are never converted or resized at full resolution
+    step = max(1, max(image.shape[:2]) // (thumbnail_size * 2))
+    small = image[::step, ::step]
+    gray = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    scale = thumbnail_size / max(gray.shape[:2])
+    
+    # A thumbnail under 6 px on a side has no full 4x4 tile of Laplacian (under 3 px
+    # its variance would be NaN), so there is nothing to measure: reject it with finite metrics
+    if min(gray.shape[:2]) * min(scale, 1.0) < 6:
+        return {
+            "acceptable": False,
+            "issues": ["field_of_view", "blurry"],
+            "sharpness": 0.0,
+            "focus_coverage": 0.0,
+            "brightness": float(gray.mean()),
+            "saturated_fraction": float((gray >= 250).mean()),
+            "field_of_view": 0.0,
+        }
+    
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = gray.astype(np.float32)
+    
+    # Field of view: share of the frame that is lit, as opposed to a black border or lens cap
+    lit = gray > gate.get("fov_threshold", 20)
+    field_of_view = float(lit.mean())
+    
+    # 4-neighbour Laplacian through array slicing; its variance is the usual focus measure
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                 - 4.0 * gray[1:-1, 1:-1])
+    sharpness = float(laplacian.var())
+    
+    # Focus coverage: share of the lit 4x4 tiles that are in focus. A sharp eye in an
+    # otherwise blurred photo has a decent overall variance but low coverage.
+    rows, cols = laplacian.shape[0] // 4, laplacian.shape[1] // 4
+    tile_energy = (laplacian[:rows * 4, :cols * 4] ** 2).reshape(4, rows, 4, cols).mean(axis=(1, 3))
+    tile_lit = lit[1:rows * 4 + 1, 1:cols * 4 + 1].reshape(4, rows, 4, cols).mean(axis=(1, 3)) > 0.5
+    lit_tiles = int(tile_lit.sum())
+    focus_coverage = float((tile_energy[tile_lit] >= gate.get("tile_sharpness", 100.0)).sum() / lit_tiles) \
+        if lit_tiles else 0.0
+    
+    brightness = float(gray.mean())
+    saturated_fraction = float((gray >= 250).mean())
+    
+    issues = []
+    if brightness < gate.get("min_brightness", 25.0):
+        issues.append("too_dark")
+    elif brightness > gate.get("max_brightness", 235.0) or \
+            saturated_fraction > gate.get("max_saturated_fraction", 0.25):
+        issues.append("overexposed")
+    if field_of_view < gate.get("min_field_of_view", 0.25):
+        issues.append("field_of_view")
+    if sharpness < gate.get("min_sharpness", 50.0) or focus_coverage < gate.get("min_focus_coverage", 0.4):
+        issues.append("blurry")
+    
+    return {
+        "acceptable": not issues,
+        "issues": issues,
+        "sharpness": sharpness,
+        "focus_coverage": focus_coverage,
+        "brightness": brightness,
+        "saturated_fraction": saturated_fraction,
+        "field_of_view": field_of_view,
+    }
+
+class PreprocessedImage(Mapping):
+    """
+    Lazily computed preprocessing variants of a retinal image
+    
+    Behaves like the dictionary preprocessing used to return, but each
+    variant is only computed (and then cached) when it is first accessed.
+    The inference path only reads "enhanced_color", so denoising and vessel
+    enhancement are skipped unless a caller asks for them.
+    
+    In "fast" preprocessing mode the image is first downscaled to the
+    configured working size, so every variant is at that resolution.
+    """
+    
+    KEYS = ("original", "rgb", "green_channel", "enhanced_green",
+            "denoised", "vessel_enhanced", "enhanced_color", "gamma_corrected")
+    
+    def __init__(self, image, config):
+        """
+        Args:
+            image: Input retinal image (BGR format)
+            config: Model configuration dictionary
+        """
+        preprocessing = config.get("preprocessing", {})
+        if preprocessing.get("mode", "full") == "fast":
+            # Enhance at a working resolution close to the model input instead of full size
+            image = _resize_to_working_size(image, preprocessing.get("working_size", 448))
+        self.image = image
+        self.clahe_clip = preprocessing.get("clahe_clip_limit", 2.0)
+        self.clahe_grid = tuple(preprocessing.get("clahe_grid_size", [8, 8]))
+        self.denoise_strength = preprocessing.get("denoise_strength", 10)
+        self.gamma = preprocessing.get("gamma_correction", 1.2)
+        self._cache = {}
+        self._compute_seconds = 0.0
+    
+    def __getitem__(self, key):
+        if key not in self._cache:
+            if key not in self.KEYS:
+                raise KeyError(key)
+            if metrics.ENABLED:
+                self._cache[key] = self._timed_compute(key)
+            else:
+                self._cache[key] = getattr(self, f"_compute_{key}")()
+        return self._cache[key]
+    
+    def _timed_compute(self, key):
+        """Compute a variant and record its own duration, excluding the variants it pulled in"""
+        nested_before = self._compute_seconds
+        start = time.perf_counter()
+        value = getattr(self, f"_compute_{key}")()
+        own = (time.perf_counter() - start) - (self._compute_seconds - nested_before)
+        self._compute_seconds += own
+        metrics.PREPROCESS_STEP_SECONDS.observe(own, step=key)
+        return value
+    
+    def __iter__(self):
+        return iter(self.KEYS)
+    
+    def __len__(self):
+        return len(self.KEYS)
+    
+    @property
+    def computed(self):
+        """Names of the variants computed so far"""
+        return [key for key in self.KEYS if key in self._cache]
+    
+    def _compute_original(self):
+        # Make a copy of the original
+        return self.image.copy()
+    
+    def _compute_rgb(self):
+        # Convert to RGB for visualization and later model input
+        return cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
+    
+    def _compute_green_channel(self):
+        # Extract channels (green channel has highest contrast for retinal features)
+        return self.image[:,:,1]
+    
+    def _compute_gamma_corrected(self):
+        # Gamma correction to enhance contrast, applied through a 256-entry lookup table
+        # instead of a floating point pow over every pixel
+        table = np.uint8(cv2.pow(np.arange(256, dtype=np.float64) / 255.0, self.gamma) * 255.0)
+        return cv2.LUT(self["green_channel"], table)
+    
+    def _compute_enhanced_green(self):
+        # Apply CLAHE for better feature visibility
+        clahe = cv2.createCLAHE(clipLimit=self.clahe_clip, tileGridSize=self.clahe_grid)
+        return clahe.apply(self["gamma_corrected"])
+    
+    def _compute_denoised(self):
+        # Denoise image (non-local means denoising preserves edges better than Gaussian)
+        return cv2.fastNlMeansDenoising(self["enhanced_green"], None, self.denoise_strength, 7, 21)
+    
+    def _compute_enhanced_color(self):
+        # Create a color enhanced version for the model. Reuse the cached RGB
+        # image if someone already asked for it, otherwise convert straight
+        # into a fresh buffer instead of converting and then copying.
+        if "rgb" in self._cache:
+            enhanced_color = self._cache["rgb"].copy()
+        else:
+            enhanced_color = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
+        enhanced_color[:,:,1] = self["enhanced_green"]  # Replace green channel with enhanced version
+        return enhanced_color
+    
+    def _compute_vessel_enhanced(self):
+        # Create composite enhancement (multiple techniques combined)
+        # Vessel enhancement using morphological operations
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        tophat = cv2.morphologyEx(self["enhanced_green"], cv2.MORPH_TOPHAT, kernel)
+        return cv2.add(self["enhanced_green"], tophat)
+
+def preprocess_retinal_image(image, config):
+    """
+    Apply advanced preprocessing techniques for retinal images
+    
+    Args:
+        image: Input retinal image (BGR format)
+        config: Model configuration dictionary
+        
+    Returns:
+        PreprocessedImage mapping of processed images, computed on first access
+    """
+    return PreprocessedImage(image, config)
+
+def prepare_model_input(processed_img, config):
+    """
+    Prepare the processed image for model prediction
+    
+    Args:
+        processed_img: Mapping of processed images (only "enhanced_color" is used)
+        config: Model configuration dictionary
+        
+    Returns:
+        Image array ready for model input
+    """
+    # Resize to model input size
+    input_size = config["input_size"]
+    img_resized = cv2.resize(processed_img["enhanced_color"], (input_size[0], input_size[1]))
+    
+    # Normalize based on configuration
+    norm_method = config.get("normalization_method", "per_image")
+    
+    if norm_method == "imagenet":
+        # Imagenet normalization (subtract mean, divide by std)
+        img_array = tf.keras.applications.efficientnet.preprocess_input(img_resized)
+    elif norm_method == "zero_one":
+        # Simple 0-1 scaling
+        img_array = img_resized / 255.0
+    else:  # per_image (default)
+        # Normalize per image (subtract mean, divide by std)
+        img_array = (img_resized - np.mean(img_resized)) / (np.std(img_resized) + 1e-7)
+    
+    # Expand dimensions for batch
+    img_array = np.expand_dims(img_array, axis=0)
+    
+    return img_array
+
+def _record_outcome(result):
+    """Count a finished analysis in the analyses metric by outcome (ok, retake or error)"""
+    if "error" in result:
+        outcome = "error"
+    elif result.get("retake_required"):
+        outcome = "retake"
+    else:
+        outcome = "ok"
+    metrics.ANALYSES.inc(outcome=outcome)
+
+def _observe_batch_stage(stage, seconds, count):
+    """Record a stage that ran once for count images as count per-image samples"""
+    if not metrics.ENABLED or count == 0:
+        return
+    for _ in range(count):
+        metrics.STAGE_SECONDS.observe(seconds / count, stage=stage)
+
 class EyeDiseaseDetector:
     """Medical-grade eye disease detection system for clinical use"""
     
-    def __init__(self, model_path='models/eye_disease_model.h5', 
-                 config_path='config/model_config.json',
+    # Order of the model's output probabilities
+    DISEASES = ['Diabetic Retinopathy', 'Glaucoma', 'Cataracts']
+    
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, 
+                 config_path=DEFAULT_CONFIG_PATH,
                  uncertainty_threshold=0.15):
         """
         Initialize the detector with model paths and configuration
@@ -31,47 +542,69 @@ class EyeDiseaseDetector:
         self.config_path = config_path
         self.uncertainty_threshold = uncertainty_threshold
         self.model = None
+        self.backend = None
+        self.ensemble = None
         self.config = None
-        self.diseases = ['Diabetic Retinopathy', 'Glaucoma', 'Cataracts']
+        self.diseases = list(self.DISEASES)
         self.version = "1.0.3"  # Version tracking for model lineage
+        self.load_time = None
+        self.warmup_time = None
+        self.batcher = None
+        self.preprocess_pool = None
+        self.result_cache = None
+        self._quality_lock = threading.Lock()
+        self._quality_stats = {"checked": 0, "rejected": 0, "issues": {}}
         
         # Load configuration if available
         self._load_config()
         
         # Load or create the model
+        start = time.perf_counter()
         self._load_model()
+        self._init_ensemble()
+        self.load_time = time.perf_counter() - start
+        logger.info(f"Model ready in {self.load_time:.2f}s")
+        
+        # Cache results by image content for repeated uploads
+        self._init_result_cache()
     
     def _load_config(self):
         """Load model configuration from JSON file"""
-        try:
-            if os.path.exists(self.config_path):
-                with open(self.config_path, 'r') as f:
-                    self.config = json.load(f)
-                logger.info(f"Configuration loaded from {self.config_path}")
-            else:
-                # Default configuration
-                self.config = {
-                    "input_size": [224, 224],
-                    "normalization_method": "per_image",
-                    "confidence_threshold": 0.5,
-                    "ensemble_models": False,
-                    "preprocessing": {
-                        "clahe_clip_limit": 2.0,
-                        "clahe_grid_size": [8, 8],
-                        "denoise_strength": 10,
-                        "gamma_correction": 1.2
-                    }
-                }
-                logger.warning(f"No configuration found at {self.config_path}. Using defaults.")
-        except Exception as e:
-            logger.error(f"Error loading configuration: {str(e)}. Using defaults.")
-            self.config = {"input_size": [224, 224], "normalization_method": "per_image"}
+        self.config = load_config(self.config_path)
+    
+    def _init_result_cache(self):
+        """Create the result cache described by config["result_cache"]"""
+        cache_config = self.config.get("result_cache", {})
+        if not cache_config.get("enabled", True):
+            return
+        
+        # Entries are only valid for this exact model version, weights file and configuration
+        model_signature = _file_signature(self.backend.model_path) if self.backend is not None else None
+        ensemble_signatures = ([_file_signature(member.model_path) for member in self.ensemble.members[1:]]
+                               if self.ensemble is not None else None)
+        fingerprint = json.dumps({"version": self.version, "backend": getattr(self.backend, "name", None),
+                                  "model": model_signature, "ensemble": ensemble_signatures, "config": self.config},
+                                 sort_keys=True, default=str)
+        namespace = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+        
+        # An untrained model is rebuilt with fresh weights per process, so never persist its results
+        disk_dir = cache_config.get("disk_dir") if model_signature is not None else None
+        
+        self.result_cache = ResultCache(
+            namespace,
+            max_memory_bytes=int(cache_config.get("max_memory_mb", 64) * 1024 * 1024),
+            disk_dir=disk_dir,
+            max_disk_bytes=int(cache_config.get("max_disk_mb", 512) * 1024 * 1024)
+        )
     
     def _load_model(self):
         """Load the pre-trained model or create a new one"""
+        if self._load_lite_backend():
+            return
+        
         try:
             if os.path.exists(self.model_path):
-                self.model = load_model(self.model_path, compile=False)
+                self.model = tf.keras.models.load_model(self.model_path, compile=False)
                 # Compile with custom metrics
                 self.model.compile(
                     optimizer='adam',
@@ -87,9 +620,74 @@ class EyeDiseaseDetector:
             logger.error(f"Error loading model: {str(e)}. Creating new model architecture.")
             self._create_model()
             logger.error("Model not trained! Results will not be clinically valid.")
+        
+        if self.model is not None:
+            self.backend = KerasBackend(self.model, self.model_path)
+    
+    def _load_lite_backend(self):
+        """
+        Load the exported model described by config["inference_backend"], if any
+        
+        Returns:
+            True if a TFLite/ONNX backend is in use, False to fall back to Keras
+        """
+        backend_config = self.config.get("inference_backend", {})
+        backend_type = backend_config.get("type", "keras")
+        if backend_type == "keras":
+            return False
+        
+        backend_path = backend_config.get("path")
+        if not backend_path or not os.path.exists(backend_path):
+            logger.warning(f"No {backend_type} model found at {backend_path}. Falling back to Keras.")
+            return False
+        
+        try:
+            self.backend = create_backend(backend_type, backend_path, num_threads=backend_config.get("num_threads"))
+        except Exception as e:
+            logger.error(f"Error loading {backend_type} model: {str(e)}. Falling back to Keras.")
+            return False
+        
+        logger.info(f"Using {backend_type} inference backend from {backend_path}")
+        return True
+    
+    def _init_ensemble(self):
+        """
+        Set up test-time augmentation and extra checkpoints when config["ensemble_models"] is on
+        
+        All passes (augmentations x checkpoints) run as one batched inference
+        call, capped at config["ensemble"]["max_passes"] to keep latency predictable.
+        """
+        if not self.config.get("ensemble_models") or self.backend is None:
+            return
+        
+        ensemble_config = self.config.get("ensemble", {})
+        num_threads = self.config.get("inference_backend", {}).get("num_threads")
+        
+        members = [self.backend]
+        for checkpoint in ensemble_config.get("checkpoints", []):
+            if not os.path.exists(checkpoint):
+                logger.warning(f"No ensemble checkpoint found at {checkpoint}. Skipping it.")
+                continue
+            try:
+                members.append(load_backend(checkpoint, num_threads=num_threads))
+            except Exception as e:
+                logger.error(f"Error loading ensemble checkpoint {checkpoint}: {str(e)}. Skipping it.")
+        
+        augmentations = ensemble_config.get("augmentations", ["identity", "hflip", "vflip", "rot180"])
+        input_size = self.config["input_size"]
+        if input_size[0] != input_size[1]:
+            # Quarter turns change the shape of non-square inputs
+            augmentations = [name for name in augmentations if name not in ("rot90", "rot270")]
+        
+        self.ensemble = EnsembleBackend(members, augmentations, max_passes=ensemble_config.get("max_passes", 8))
+        logger.info(f"Ensemble enabled: {len(self.ensemble.members)} models x "
+                    f"{len(self.ensemble.augmentations)} augmentations ({', '.join(self.ensemble.augmentations)})")
     
     def _create_model(self):
         """Create model architecture for eye disease detection"""
+        from tensorflow.keras.applications import EfficientNetB4
+        from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, BatchNormalization
+        
         # Use EfficientNet which is more parameter-efficient and accurate
         base_model = EfficientNetB4(
             weights='imagenet',
@@ -107,7 +705,8 @@ class EyeDiseaseDetector:
         x = Dense(256, activation='relu')(x)
         x = BatchNormalization()(x)
         x = Dropout(0.3)(x)
-        predictions = Dense(len(self.diseases), activation='softmax')(x)
+        # Kept in float32 so the softmax stays stable under a mixed precision policy
+        predictions = Dense(len(self.diseases), activation='softmax', dtype='float32')(x)
         
         # Create and compile the model
         self.model = tf.keras.models.Model(inputs=base_model.input, outputs=predictions)
@@ -117,21 +716,121 @@ class EyeDiseaseDetector:
             metrics=['accuracy', tf.keras.metrics.AUC(), tf.keras.metrics.Precision(), tf.keras.metrics.Recall()]
         )
     
-    def train(self, train_data, validation_data, epochs=50, batch_size=32):
+    def warmup(self):
+        """
+        Run a dummy inference so the first real request does not pay for
+        graph tracing and kernel initialization
+        
+        Returns:
+            Warmup duration in seconds, or None if no model is loaded
+        """
+        if self.backend is None:
+            return None
+        
+        input_size = self.config["input_size"]
+        dummy = np.zeros((1, input_size[1], input_size[0], 3), dtype=np.float32)
+        
+        start = time.perf_counter()
+        self._predict_batch(dummy)
+        self.warmup_time = time.perf_counter() - start
+        logger.info(f"Model warmed up in {self.warmup_time:.2f}s")
+        
+        return self.warmup_time
+    
+    def enable_batching(self, max_batch_size=None, max_wait_ms=None):
+        """
+        Route predictions through a micro-batching queue shared by concurrent callers
+        
+        Args:
+            max_batch_size: Maximum images per model call (defaults to config)
+            max_wait_ms: Maximum time a request waits for a batch to fill (defaults to config)
+            
+        Returns:
+            The InferenceBatcher in use
+        """
+        if self.batcher is not None:
+            return self.batcher
+        
+        batching_config = self.config.get("batching", {})
+        if max_batch_size is None:
+            max_batch_size = batching_config.get("max_batch_size", 16)
+        if max_wait_ms is None:
+            max_wait_ms = batching_config.get("max_wait_ms", 10)
+        
+        self.batcher = InferenceBatcher(self._predict_passes, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        logger.info(f"Micro-batching enabled (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms})")
+        return self.batcher
+    
+    def disable_batching(self):
+        """Stop the micro-batching queue and go back to direct model calls"""
+        if self.batcher is not None:
+            self.batcher.stop()
+            self.batcher = None
+    
+    def _predict_passes(self, batch):
+        """
+        Run the inference backend on a batch of prepared images, keeping each ensemble pass
+        
+        Args:
+            batch: Array of shape (N, height, width, 3)
+            
+        Returns:
+            NumPy array of shape (N, passes, number of diseases); passes is 1 without an ensemble
+        """
+        metrics.INFERENCE_BATCH_SIZE.observe(len(batch))
+        if self.ensemble is not None:
+            with metrics.INFERENCE_SECONDS.time(backend=self.ensemble.name):
+                return self.ensemble.predict_passes(batch)
+        with metrics.INFERENCE_SECONDS.time(backend=self.backend.name):
+            return self.backend.predict(batch)[:, np.newaxis]
+    
+    def _predict_batch(self, batch):
+        """
+        Run the inference backend on a batch of prepared images
+        
+        Args:
+            batch: Array of shape (N, height, width, 3)
+            
+        Returns:
+            NumPy array of shape (N, number of diseases), averaged over ensemble passes
+        """
+        return self._predict_passes(batch).mean(axis=1)
+    
+    def _predict(self, img_array):
+        """
+        Predict through the batching queue when enabled, otherwise call the model directly
+        
+        Returns:
+            NumPy array of shape (N, passes, number of diseases)
+        """
+        # Read once: a reload may disable batching on this detector while requests are in flight
+        batcher = self.batcher
+        if batcher is not None:
+            try:
+                return batcher.predict(img_array)
+            except BatcherStoppedError:
+                pass
+        return self._predict_passes(img_array)
+    
+    def train(self, train_data, validation_data, epochs=50, batch_size=32, callbacks=None):
         """
         Train the model using the provided datasets
         
         Args:
-            train_data: Training dataset (tf.data.Dataset format)
+            train_data: Training dataset (tf.data.Dataset format, see training.build_dataset)
             validation_data: Validation dataset
             epochs: Number of training epochs
             batch_size: Batch size for training
+            callbacks: Additional Keras callbacks (e.g. training.ThroughputCallback)
             
         Returns:
             Training history
         """
+        from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+        
         if self.model is None:
             self._create_model()
+            self.backend = KerasBackend(self.model, self.model_path)
         
         # Define callbacks for training
         callbacks = [
@@ -157,7 +856,7 @@ class EyeDiseaseDetector:
                 patience=5,
                 min_lr=1e-6
             )
-        ]
+        ] + list(callbacks or [])
         
         # Train the model
         history = self.model.fit(
@@ -181,53 +880,9 @@ class EyeDiseaseDetector:
             image: Input retinal image (BGR format)
             
         Returns:
-            Dictionary of processed images
+            PreprocessedImage mapping of processed images, computed on first access
         """
-        # Get preprocessing parameters from config
-        clahe_clip = self.config["preprocessing"].get("clahe_clip_limit", 2.0)
-        clahe_grid = tuple(self.config["preprocessing"].get("clahe_grid_size", [8, 8]))
-        denoise_strength = self.config["preprocessing"].get("denoise_strength", 10)
-        gamma = self.config["preprocessing"].get("gamma_correction", 1.2)
-        
-        # Make a copy of the original
-        original = image.copy()
-        
-        # Convert to RGB for visualization and later model input
-        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Extract channels (green channel has highest contrast for retinal features)
-        green_channel = image[:,:,1]
-        
-        # Gamma correction to enhance contrast
-        gamma_corrected = np.uint8(cv2.pow(green_channel / 255.0, gamma) * 255.0)
-        
-        # Apply CLAHE for better feature visibility
-        clahe = cv2.createCLAHE(clipLimit=clahe_clip, tileGridSize=clahe_grid)
-        enhanced_green = clahe.apply(gamma_corrected)
-        
-        # Denoise image (non-local means denoising preserves edges better than Gaussian)
-        denoised = cv2.fastNlMeansDenoising(enhanced_green, None, denoise_strength, 7, 21)
-        
-        # Create a color enhanced version for the model
-        enhanced_color = rgb.copy()
-        enhanced_color[:,:,1] = enhanced_green  # Replace green channel with enhanced version
-        
-        # Create composite enhancement (multiple techniques combined)
-        # Vessel enhancement using morphological operations
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        tophat = cv2.morphologyEx(enhanced_green, cv2.MORPH_TOPHAT, kernel)
-        vessel_enhanced = cv2.add(enhanced_green, tophat)
-        
-        return {
-            "original": original,
-            "rgb": rgb,
-            "green_channel": green_channel,
-            "enhanced_green": enhanced_green,
-            "denoised": denoised,
-            "vessel_enhanced": vessel_enhanced,
-            "enhanced_color": enhanced_color,
-            "gamma_corrected": gamma_corrected
-        }
+        return preprocess_retinal_image(image, self.config)
     
     def prepare_for_model(self, processed_img):
         """
@@ -239,27 +894,7 @@ class EyeDiseaseDetector:
         Returns:
             Image array ready for model input
         """
-        # Resize to model input size
-        input_size = self.config["input_size"]
-        img_resized = cv2.resize(processed_img["enhanced_color"], (input_size[0], input_size[1]))
-        
-        # Normalize based on configuration
-        norm_method = self.config.get("normalization_method", "per_image")
-        
-        if norm_method == "imagenet":
-            # Imagenet normalization (subtract mean, divide by std)
-            img_array = tf.keras.applications.efficientnet.preprocess_input(img_resized)
-        elif norm_method == "zero_one":
-            # Simple 0-1 scaling
-            img_array = img_resized / 255.0
-        else:  # per_image (default)
-            # Normalize per image (subtract mean, divide by std)
-            img_array = (img_resized - np.mean(img_resized)) / (np.std(img_resized) + 1e-7)
-        
-        # Expand dimensions for batch
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        return img_array
+        return prepare_model_input(processed_img, self.config)
     
     def _adjust_probabilities(self, predictions):
         """
@@ -304,29 +939,105 @@ class EyeDiseaseDetector:
         logger.info(f"Original probabilities: {predictions}, Adjusted: {adjusted_probs}")
         return adjusted_probs
     
-    def analyze(self, image_path):
+    def check_quality(self, img):
+        """
+        Run the quality gate on a decoded image and count the outcome
+        
+        Args:
+            img: Decoded BGR image
+            
+        Returns:
+            Quality assessment dictionary, or None if the gate is disabled
+        """
+        if not quality_gate_enabled(self.config):
+            return None
+        
+        with metrics.STAGE_SECONDS.time(stage="quality"):
+            quality = assess_image_quality(img, self.config)
+        self._record_quality(quality)
+        return quality
+    
+    def _record_quality(self, quality):
+        with self._quality_lock:
+            self._quality_stats["checked"] += 1
+            if not quality["acceptable"]:
+                self._quality_stats["rejected"] += 1
+                for issue in quality["issues"]:
+                    self._quality_stats["issues"][issue] = self._quality_stats["issues"].get(issue, 0) + 1
+        if not quality["acceptable"]:
+            for issue in quality["issues"]:
+                metrics.REJECTED_SCANS.inc(reason=issue)
+    
+    def quality_stats(self):
+        """Counts of images checked and rejected by the quality gate, by reason"""
+        with self._quality_lock:
+            return dict(self._quality_stats, issues=dict(self._quality_stats["issues"]))
+    
+    def _retake_result(self, quality, height, width, channels):
+        """Structured response asking the user to retake an image that failed the quality gate"""
+        return {
+            "height": int(height),
+            "width": int(width),
+            "channels": int(channels),
+            "retake_required": True,
+            "quality": quality,
+            "guidance": [QUALITY_GUIDANCE[issue] for issue in quality["issues"]],
+            "model_version": self.version,
+            "message": "Image quality is too low for a reliable analysis. Please retake the image."
+        }
+    
+    def analyze(self, image_source):
         """
         Analyze an eye image for disease detection
         
         Args:
-            image_path: Path to the image file
+            image_source: Path to the image file, encoded image bytes (e.g. an
+                upload read straight from the request) or a decoded BGR array
             
         Returns:
             Dictionary with analysis results
         """
+        image_name = image_source if _is_path(image_source) else "in-memory image"
+        with metrics.ANALYSES_IN_PROGRESS.track_in_progress(), metrics.ANALYSIS_SECONDS.time(), \
+                metrics.trace(image_name):
+            result = self._analyze(image_source, image_name)
+        _record_outcome(result)
+        return result
+    
+    def _analyze(self, image_source, image_name):
+        """Run analyze() for one image, timing each stage"""
         try:
-            # Read the image
-            img = cv2.imread(image_path)
+            cache_key = None
+            if self.result_cache is not None and not _is_decoded_image(image_source):
+                # Hash the bytes we are about to decode, so the file is only read once
+                data = _read_file_bytes(image_source) if _is_path(image_source) else image_source
+                if data is None:
+                    logger.error(f"Could not read image at {image_name}")
+                    return {"error": "Could not read the image."}
+                
+                cache_key = self.result_cache.key(data)
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    metrics.RESULT_CACHE_HITS.inc()
+                    logger.info(f"Analysis served from cache for {image_name}")
+                    return cached
+                
+                with metrics.STAGE_SECONDS.time(stage="decode"):
+                    img, original_shape = decode_image_bytes(data, self.config)
+            else:
+                # Read the image (at reduced resolution in fast preprocessing mode)
+                with metrics.STAGE_SECONDS.time(stage="decode"):
+                    img, original_shape = load_image_source(image_source, self.config)
             
             if img is None:
-                logger.error(f"Could not read image at {image_path}")
+                logger.error(f"Could not read image at {image_name}")
                 return {"error": "Could not read the image."}
             
             # Get original dimensions
-            height, width, channels = img.shape
+            height, width, channels = original_shape
             
             # Check if model is available
-            if self.model is None:
+            if self.backend is None:
                 logger.error("No trained model available for analysis")
                 return {
                     "error": "No trained model available for analysis.",
@@ -335,69 +1046,415 @@ class EyeDiseaseDetector:
                     "channels": int(channels),
                 }
             
-            # Preprocess the image
-            processed_img = self.preprocess_image(img)
+            # Reject unusable images before the expensive preprocessing and inference
+            quality = self.check_quality(img)
+            if quality is not None and not quality["acceptable"]:
+                logger.info(f"Quality gate rejected {image_name}: {', '.join(quality['issues'])}")
+                result = self._retake_result(quality, height, width, channels)
+                if cache_key is not None:
+                    self.result_cache.put(cache_key, result)
+                return result
             
-            # Prepare for model
-            img_array = self.prepare_for_model(processed_img)
+            # Preprocess the image. Variants are computed on first access, so
+            # build the model's input variant here to attribute its cost to this stage
+            with metrics.STAGE_SECONDS.time(stage="preprocess"):
+                processed_img = self.preprocess_image(img)
+                processed_img["enhanced_color"]
             
-            # Get model predictions
-            raw_predictions = self.model.predict(img_array)[0]
+            # Prepare for model
+            with metrics.STAGE_SECONDS.time(stage="prepare"):
+                img_array = self.prepare_for_model(processed_img)
             
-            # FEATURE: Adjust predictions to make highest probability always 90%
-            predictions = self._adjust_probabilities(raw_predictions)
+            # Get model predictions (including any wait for a micro-batch)
+            with metrics.STAGE_SECONDS.time(stage="predict"):
+                passes = self._predict(img_array)[0]
             
-            # Convert NumPy types to Python native types for JSON serialization
-            predictions = [float(p) for p in predictions]
+            with metrics.STAGE_SECONDS.time(stage="postprocess"):
+                result = self._build_result(passes.mean(axis=0), height, width, channels, passes=passes)
             
-            # Create disease probability dictionary
-            disease_probabilities = {disease: float(prob) for disease, prob in zip(self.diseases, predictions)}
+            if cache_key is not None:
+                self.result_cache.put(cache_key, result)
             
-            # Find most likely disease
-            most_likely_idx = np.argmax(predictions)
-            most_likely_disease = self.diseases[most_likely_idx]
-            max_probability = float(predictions[most_likely_idx])
+            # Log analysis completion
+            logger.info(f"Analysis completed for {image_name}: {result['most_likely_disease']} ({result['confidence']:.2f})")
             
-            # Check for uncertainty in the prediction (using raw predictions for this check)
-            sorted_raw_probs = np.sort(raw_predictions)[::-1]
-            margin = sorted_raw_probs[0] - sorted_raw_probs[1]  # Difference between top two probabilities
+            return result
             
-            # As per requirement: if a disease has 90% probability, it's never considered uncertain
-            if max_probability >= 0.9:
-                is_uncertain = False
-            else:
-                is_uncertain = bool(margin < self.uncertainty_threshold)  # Convert numpy.bool_ to Python bool
+        except Exception as e:
+            logger.error(f"Error during analysis: {str(e)}")
+            return {"error": str(e)}
+    
+    def get_preprocess_pool(self, workers):
+        """
+        Return the worker pool used for pipelined preprocessing, starting it on first use
+        
+        Args:
+            workers: Number of worker processes
             
-            # Check confidence threshold from config
-            confidence_threshold = self.config.get("confidence_threshold", 0.5)
-            disease_detected = bool(max_probability > confidence_threshold)  # Convert numpy.bool_ to Python bool
+        Returns:
+            PreprocessPool instance
+        """
+        # Imported here because the pipeline workers import this module
+        from pipeline import PreprocessPool
+        
+        if self.preprocess_pool is not None and self.preprocess_pool.workers != workers:
+            self.preprocess_pool.close()
+            self.preprocess_pool = None
+        if self.preprocess_pool is None:
+            self.preprocess_pool = PreprocessPool(self.config, workers)
+        return self.preprocess_pool
+    
+    def iter_analyze_batch(self, image_paths, batch_size=32, workers=None):
+        """
+        Analyze many eye images, running inference batch_size images at a time
+        
+        Only one batch of prepared images is held in memory at once, so this
+        can stream through arbitrarily long lists of files.
+        
+        Args:
+            image_paths: Iterable of image file paths, or of (name, source) pairs
+                where source is anything analyze() accepts
+            batch_size: Number of images per model call
+            workers: Worker processes for decoding and preprocessing (defaults to
+                config["pipeline"]["workers"]; 0 runs them on the calling thread)
+        
+        Yields:
+            (image_path, result) tuples in input order; images that fail before
+            inference are held back until the batch before them has run
+        """
+        if workers is None:
+            workers = self.config.get("pipeline", {}).get("workers", 0)
+        if workers and self.backend is not None:
+            results = self._iter_analyze_pipelined(image_paths, batch_size, workers)
+        else:
+            results = self._iter_analyze_serial(image_paths, batch_size)
+        
+        for image_path, result in results:
+            _record_outcome(result)
+            yield image_path, result
+    
+    def _iter_analyze_serial(self, image_paths, batch_size):
+        """Analyze images with decoding and preprocessing on the calling thread"""
+        # (image_path, shape, model input, result); results are already known for
+        # images that never reach the model, which wait here to keep input order
+        pending = []
+        queued = 0
+        
+        for item in image_paths:
+            image_path, source = split_named_source(item)
+            try:
+                with metrics.STAGE_SECONDS.time(stage="decode"):
+                    img, original_shape = load_image_source(source, self.config)
+                
+                if img is None:
+                    logger.error(f"Could not read image at {image_path}")
+                    pending.append((image_path, None, None, {"error": "Could not read the image."}))
+                    continue
+                
+                height, width, channels = original_shape
+                
+                if self.backend is None:
+                    pending.append((image_path, None, None, {
+                        "error": "No trained model available for analysis.",
+                        "height": int(height),
+                        "width": int(width),
+                        "channels": int(channels),
+                    }))
+                    continue
+                
+                quality = self.check_quality(img)
+                if quality is not None and not quality["acceptable"]:
+                    pending.append((image_path, None, None, self._retake_result(quality, height, width, channels)))
+                    continue
+                
+                with metrics.STAGE_SECONDS.time(stage="preprocess"):
+                    processed_img = self.preprocess_image(img)
+                    processed_img["enhanced_color"]
+                with metrics.STAGE_SECONDS.time(stage="prepare"):
+                    img_array = self.prepare_for_model(processed_img)
+            except Exception as e:
+                logger.error(f"Error preparing {image_path}: {str(e)}")
+                pending.append((image_path, None, None, {"error": str(e)}))
+                continue
             
-            # Create diagnosis and recommendation
-            diagnosis = self._create_diagnosis(disease_probabilities, is_uncertain)
+            pending.append((image_path, original_shape, img_array, None))
+            queued += 1
+            if queued >= batch_size:
+                yield from self._analyze_pending(pending)
+                pending = []
+                queued = 0
+        
+        if pending:
+            yield from self._analyze_pending(pending)
+    
+    def _iter_analyze_pipelined(self, image_paths, batch_size, workers):
+        """Analyze images with decoding and preprocessing overlapped with inference"""
+        pool = self.get_preprocess_pool(workers)
+        pending = []
+        queued = 0
+        
+        for image_path, shape, img_array, error, quality in pool.imap(image_paths):
+            if error is not None:
+                logger.error(f"Error preparing {image_path}: {error}")
+                pending.append((image_path, None, None, {"error": error}))
+                continue
             
-            # Return results - ensure all values are JSON serializable native Python types
-            result = {
-                "height": int(height),  # Ensure int not numpy.int32/int64
-                "width": int(width),
-                "channels": int(channels),
-                "disease_detected": bool(disease_detected),  
-                "most_likely_disease": most_likely_disease if disease_detected else "No disease detected",
-                "confidence": float(max_probability),  
-                "disease_probabilities": disease_probabilities,  
-                "uncertain_prediction": bool(is_uncertain),
-                "diagnosis": diagnosis,
-                "model_version": self.version,
-                "message": "Eye disease analysis completed."
-            }
+            # The gate itself ran in the worker; only the outcome is counted here
+            if quality is not None:
+                self._record_quality(quality)
+                if not quality["acceptable"]:
+                    pending.append((image_path, None, None, self._retake_result(quality, *shape)))
+                    continue
             
-            # Log analysis completion
-            logger.info(f"Analysis completed for {image_path}: {most_likely_disease} ({max_probability:.2f})")
+            pending.append((image_path, shape, img_array, None))
+            queued += 1
+            if queued >= batch_size:
+                start = time.perf_counter()
+                results = list(self._analyze_pending(pending))
+                pool.record("inference", time.perf_counter() - start, count=queued)
+                yield from results
+                pending = []
+                queued = 0
+        
+        if pending:
+            start = time.perf_counter()
+            results = list(self._analyze_pending(pending))
+            if queued:
+                pool.record("inference", time.perf_counter() - start, count=queued)
+            yield from results
+    
+    def _analyze_pending(self, pending):
+        """
+        Run one model call over the prepared images in pending and yield every
+        entry's result in order
+        
+        Args:
+            pending: List of (image_path, shape, model input, result) tuples; the
+                result is given, and the model input None, for images the model skips
+        """
+        arrays = [img_array for _, _, img_array, result in pending if result is None]
+        passes_batch = iter(())
+        error = None
+        if arrays:
+            try:
+                start = time.perf_counter()
+                passes_batch = iter(self._predict_passes(np.concatenate(arrays, axis=0)))
+                # One model call for the batch: each image gets its share, as the stage is per image
+                _observe_batch_stage("predict", time.perf_counter() - start, len(arrays))
+            except Exception as e:
+                logger.error(f"Error during batch inference: {str(e)}")
+                error = str(e)
+        
+        for image_path, shape, _, result in pending:
+            if result is None:
+                if error is not None:
+                    result = {"error": error}
+                else:
+                    height, width, channels = shape
+                    passes = next(passes_batch)
+                    with metrics.STAGE_SECONDS.time(stage="postprocess"):
+                        result = self._build_result(passes.mean(axis=0), height, width, channels, passes=passes)
+                    logger.info(f"Analysis completed for {image_path}: {result['most_likely_disease']} "
+                                f"({result['confidence']:.2f})")
+            yield image_path, result
+    
+    def analyze_batch(self, image_paths, batch_size=32, workers=None):
+        """
+        Analyze a list of eye images using batched inference
+        
+        Args:
+            image_paths: List of image file paths, or of (name, source) pairs
+            batch_size: Number of images per model call
+            workers: Worker processes for decoding and preprocessing (defaults to config)
+        
+        Returns:
+            List of analysis result dictionaries, each with an "image_path" key
+        """
+        return [dict(result, image_path=image_path)
+                for image_path, result in self.iter_analyze_batch(image_paths, batch_size=batch_size, workers=workers)]
+    
+    def analyze_stream(self, frames, batch_size=None):
+        """
+        Analyze a video burst or image sequence as a single examination
+        
+        Frames go through the same quality gate as single images first, and only
+        those that pass go through preprocessing and the model, a batch at a
+        time. The probabilities of the analyzed frames are averaged into one
+        result. Rejected frames are not counted as rejected scans.
+        
+        Args:
+            frames: Iterable of (frame index, BGR frame) tuples, e.g. from streaming.open_frames
+            batch_size: Frames per model call (defaults to config)
             
-            return result
+        Returns:
+            Dictionary with analysis results and a "frames" summary
+        """
+        if batch_size is None:
+            batch_size = self.config.get("streaming", {}).get("batch_size", 8)
+        
+        with metrics.ANALYSES_IN_PROGRESS.track_in_progress():
+            result = self._analyze_stream(frames, batch_size)
+        _record_outcome(result)
+        return result
+    
+    def _analyze_stream(self, frames, batch_size):
+        """Run analyze_stream(), timing each stage per frame"""
+        gate_enabled = quality_gate_enabled(self.config)
+        summary = {"received": 0, "analyzed": 0, "rejected": 0, "rejection_reasons": {}, "sharpest_frame": None}
+        if self.backend is None:
+            return {"error": "No trained model available for analysis.", "frames": summary}
+        
+        # Running sums keep memory constant in the number of frames
+        probability_sum = None
+        probability_sq_sum = None
+        best_sharpness = -1.0
+        shape = None
+        pending = []
+        
+        def flush():
+            nonlocal probability_sum, probability_sq_sum
+            start = time.perf_counter()
+            raw_batch = self._predict_batch(np.concatenate(pending, axis=0)).astype(np.float64)
+            _observe_batch_stage("predict", time.perf_counter() - start, len(pending))
+            if probability_sum is None:
+                probability_sum = np.zeros(raw_batch.shape[1])
+                probability_sq_sum = np.zeros(raw_batch.shape[1])
+            probability_sum += raw_batch.sum(axis=0)
+            probability_sq_sum += (raw_batch ** 2).sum(axis=0)
+            summary["analyzed"] += len(pending)
+            pending.clear()
+        
+        try:
+            for index, frame in frames:
+                summary["received"] += 1
+                if gate_enabled:
+                    with metrics.STAGE_SECONDS.time(stage="quality"):
+                        quality = assess_image_quality(frame, self.config)
+                    if not quality["acceptable"]:
+                        summary["rejected"] += 1
+                        for issue in quality["issues"]:
+                            summary["rejection_reasons"][issue] = summary["rejection_reasons"].get(issue, 0) + 1
+                        continue
+                    
+                    if quality["sharpness"] > best_sharpness:
+                        best_sharpness = quality["sharpness"]
+                        summary["sharpest_frame"] = index
+                shape = frame.shape
+                
+                with metrics.STAGE_SECONDS.time(stage="preprocess"):
+                    processed_frame = self.preprocess_image(frame)
+                    processed_frame["enhanced_color"]
+                with metrics.STAGE_SECONDS.time(stage="prepare"):
+                    pending.append(self.prepare_for_model(processed_frame))
+                if len(pending) >= batch_size:
+                    flush()
             
+            if pending:
+                flush()
         except Exception as e:
-            logger.error(f"Error during analysis: {str(e)}")
-            return {"error": str(e)}
+            logger.error(f"Error during stream analysis: {str(e)}")
+            return {"error": str(e), "frames": summary}
+        
+        if summary["analyzed"] == 0:
+            logger.warning(f"No usable frames in stream ({summary['received']} received)")
+            return {"error": "No frames were sharp and bright enough to analyze. Please retake the recording.",
+                    "frames": summary}
+        
+        mean = probability_sum / summary["analyzed"]
+        std = np.sqrt(np.maximum(probability_sq_sum / summary["analyzed"] - mean ** 2, 0.0))
+        summary["probability_std"] = {disease: float(value) for disease, value in zip(self.diseases, std)}
+        
+        height, width = shape[:2]
+        with metrics.STAGE_SECONDS.time(stage="postprocess"):
+            result = self._build_result(mean.astype(np.float32), height, width, shape[2] if len(shape) > 2 else 1)
+        result["frames"] = summary
+        logger.info(f"Stream analysis completed over {summary['analyzed']}/{summary['received']} frames: "
+                    f"{result['most_likely_disease']} ({result['confidence']:.2f})")
+        return result
+    
+    def _build_result(self, raw_predictions, height, width, channels, passes=None):
+        """
+        Turn raw model outputs for one image into the analysis result
+        
+        Args:
+            raw_predictions: Model output probabilities for one image
+            height: Original image height
+            width: Original image width
+            channels: Original number of channels
+            passes: Per-pass probabilities of shape (passes, number of diseases) when
+                an ensemble is in use; their spread also marks a prediction uncertain
+            
+        Returns:
+            Dictionary with analysis results
+        """
+        # FEATURE: Adjust predictions to make highest probability always 90%
+        predictions = self._adjust_probabilities(raw_predictions)
+        
+        # Convert NumPy types to Python native types for JSON serialization
+        predictions = [float(p) for p in predictions]
+        
+        # Create disease probability dictionary
+        disease_probabilities = {disease: float(prob) for disease, prob in zip(self.diseases, predictions)}
+        
+        # Find most likely disease
+        most_likely_idx = np.argmax(predictions)
+        most_likely_disease = self.diseases[most_likely_idx]
+        max_probability = float(predictions[most_likely_idx])
+        
+        # Check for uncertainty in the prediction (using raw predictions for this check)
+        sorted_raw_probs = np.sort(raw_predictions)[::-1]
+        margin = sorted_raw_probs[0] - sorted_raw_probs[1]  # Difference between top two probabilities
+        
+        # As per requirement: if a disease has 90% probability, it's never considered uncertain
+        if max_probability >= 0.9:
+            is_uncertain = False
+        else:
+            is_uncertain = bool(margin < self.uncertainty_threshold)  # Convert numpy.bool_ to Python bool
+        
+        # Ensemble passes that disagree on the top disease make the prediction uncertain regardless
+        ensemble_info = None
+        if passes is not None and len(passes) > 1:
+            spread = np.std(passes, axis=0)
+            max_std = self.config.get("ensemble", {}).get("max_std", 0.1)
+            if spread[np.argmax(raw_predictions)] > max_std:
+                is_uncertain = True
+            ensemble_info = {
+                "passes": int(len(passes)),
+                "models": len(self.ensemble.members),
+                "augmentations": list(self.ensemble.augmentations),
+                "probability_std": {disease: float(std) for disease, std in zip(self.diseases, spread)}
+            }
+        
+        if is_uncertain:
+            metrics.UNCERTAIN_PREDICTIONS.inc()
+        
+        # Check confidence threshold from config
+        confidence_threshold = self.config.get("confidence_threshold", 0.5)
+        disease_detected = bool(max_probability > confidence_threshold)  # Convert numpy.bool_ to Python bool
+        
+        # Create diagnosis and recommendation
+        diagnosis = self._create_diagnosis(disease_probabilities, is_uncertain)
+        
+        # Return results - ensure all values are JSON serializable native Python types
+        result = {
+            "height": int(height),  # Ensure int not numpy.int32/int64
+            "width": int(width),
+            "channels": int(channels),
+            "disease_detected": bool(disease_detected),  
+            "most_likely_disease": most_likely_disease if disease_detected else "No disease detected",
+            "confidence": float(max_probability),  
+            "disease_probabilities": disease_probabilities,  
+            # Model output before the display adjustment above, e.g. for tracking trends
+            "raw_probabilities": {disease: float(prob) for disease, prob in zip(self.diseases, raw_predictions)},
+            "uncertain_prediction": bool(is_uncertain),
+            "diagnosis": diagnosis,
+            "model_version": self.version,
+            "message": "Eye disease analysis completed."
+        }
+        if ensemble_info is not None:
+            result["ensemble"] = ensemble_info
+        
+        return result
     
     def _create_diagnosis(self, probabilities, is_uncertain):
         """
@@ -444,20 +1501,167 @@ class EyeDiseaseDetector:
         
         return diagnosis
 
+# Process-wide registry of loaded detectors, keyed by (model_path, config_path)
+_detector_registry = {}
+_registry_lock = threading.Lock()
+_registry_stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+def _file_signature(path):
+    """Return (mtime, size) of a file so changes can be detected cheaply, or None if missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _backend_signature(config):
+    """
+    Signature of the exported TFLite/ONNX model config["inference_backend"] selects
+    
+    Returns:
+        (path, file signature) of the configured artifact, or None when Keras serves the model
+    """
+    backend_config = config.get("inference_backend", {})
+    backend_path = backend_config.get("path")
+    if backend_config.get("type", "keras") == "keras" or not backend_path:
+        return None
+    return (os.path.abspath(backend_path), _file_signature(backend_path))
+
+def get_detector(model_path=DEFAULT_MODEL_PATH, config_path=DEFAULT_CONFIG_PATH, warmup=True, batching=False):
+    """
+    Return a cached detector for the given model and configuration
+    
+    The detector is built once per process and reused across requests. It is
+    rebuilt only when the model, the configuration file or the exported
+    TFLite/ONNX model the configuration selects changes on disk.
+    
+    Args:
+        model_path: Path to the trained model
+        config_path: Path to model configuration file
+        warmup: Run a dummy inference after (re)loading the model
+        batching: Route predictions through the shared micro-batching queue
+        
+    Returns:
+        EyeDiseaseDetector instance
+    """
+    key = (os.path.abspath(model_path), os.path.abspath(config_path))
+    signature = (_file_signature(model_path), _file_signature(config_path))
+    
+    with _registry_lock:
+        entry = _detector_registry.get(key)
+        # The artifact path comes from the loaded configuration; a config change reloads anyway
+        if (entry is not None and entry["signature"] == signature
+                and entry["backend_signature"] == _backend_signature(entry["detector"].config)):
+            entry["hits"] += 1
+            _registry_stats["hits"] += 1
+            detector = entry["detector"]
+            if batching:
+                detector.enable_batching()
+            return detector
+        
+        _registry_stats["misses"] += 1
+        if entry is not None:
+            _registry_stats["reloads"] += 1
+            logger.info(f"Model, exported model or configuration changed on disk. Reloading detector for {model_path}")
+            entry["detector"].disable_batching()
+            if entry["detector"].preprocess_pool is not None:
+                entry["detector"].preprocess_pool.close()
+        
+        detector = EyeDiseaseDetector(model_path=model_path, config_path=config_path)
+        if warmup:
+            detector.warmup()
+        if batching:
+            detector.enable_batching()
+        
+        _detector_registry[key] = {
+            "detector": detector,
+            "signature": signature,
+            "backend_signature": _backend_signature(detector.config),
+            "loaded_at": time.time(),
+            "hits": 0
+        }
+        return detector
+
+def register_detector(detector, model_path=DEFAULT_MODEL_PATH, config_path=DEFAULT_CONFIG_PATH):
+    """
+    Make get_detector return an already built detector for a model and configuration
+    
+    Lets tools serve the exact detector they built (e.g. from other paths)
+    through code that looks it up with the default paths.
+    
+    Args:
+        detector: EyeDiseaseDetector instance
+        model_path: Model path it is served under
+        config_path: Configuration path it is served under
+    """
+    key = (os.path.abspath(model_path), os.path.abspath(config_path))
+    with _registry_lock:
+        _detector_registry[key] = {
+            "detector": detector,
+            "signature": (_file_signature(model_path), _file_signature(config_path)),
+            "backend_signature": _backend_signature(detector.config),
+            "loaded_at": time.time(),
+            "hits": 0
+        }
+
+def peek_detector(model_path=DEFAULT_MODEL_PATH, config_path=DEFAULT_CONFIG_PATH):
+    """
+    Return the already-loaded detector for a model and configuration without loading one
+    
+    Args:
+        model_path: Path to the trained model
+        config_path: Path to model configuration file
+        
+    Returns:
+        EyeDiseaseDetector instance, or None if it has not been loaded yet
+    """
+    # No lock: get_detector holds it for the whole load, and health checks must not wait on that
+    entry = _detector_registry.get((os.path.abspath(model_path), os.path.abspath(config_path)))
+    return entry["detector"] if entry is not None else None
+
+def get_registry_stats():
+    """
+    Summarize the detector registry for monitoring
+    
+    Returns:
+        Dictionary with global hit/miss counts and per-detector load details
+    """
+    with _registry_lock:
+        detectors = [
+            {
+                "model_path": key[0],
+                "config_path": key[1],
+                "model_version": entry["detector"].version,
+                "loaded_at": entry["loaded_at"],
+                "load_time": entry["detector"].load_time,
+                "warmup_time": entry["detector"].warmup_time,
+                "inference_backend": getattr(entry["detector"].backend, "name", None),
+                "ensemble_passes": entry["detector"].ensemble.passes if entry["detector"].ensemble is not None else None,
+                "hits": entry["hits"],
+                "batching": entry["detector"].batcher.stats() if entry["detector"].batcher is not None else None,
+                "pipeline": entry["detector"].preprocess_pool.stats() if entry["detector"].preprocess_pool is not None else None,
+                "result_cache": entry["detector"].result_cache.stats() if entry["detector"].result_cache is not None else None,
+                "quality_gate": entry["detector"].quality_stats()
+            }
+            for key, entry in _detector_registry.items()
+        ]
+        return dict(_registry_stats, detectors=detectors)
+
 # Helper function to process a single image
-def process_image(image_path, model_path='models/eye_disease_model.h5'):
+def process_image(image_source, model_path=DEFAULT_MODEL_PATH, batching=False):
     """
     Process a single image for eye disease detection
     
     Args:
-        image_path: Path to the image file
+        image_source: Path to the image file or encoded image bytes
         model_path: Path to the trained model
+        batching: Share model calls with concurrent requests via micro-batching
         
     Returns:
         Analysis results dictionary
     """
-    # Create detector
-    detector = EyeDiseaseDetector(model_path=model_path)
+    # Reuse the process-wide detector instead of reloading the model per image
+    detector = get_detector(model_path=model_path, batching=batching)
     
     # Analyze image
-    return detector.analyze(image_path)
\ No newline at end of file
+    return detector.analyze(image_source)
@@ -0,0 +1,57 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+class AuthError(ValueError):
+    """Raised when a request's access token is missing or cannot be verified"""
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+def verify_token(token, secret, audience="authenticated", leeway=30):
+    """
+    Verify a Supabase access token (an HS256 JWT signed with the project's JWT secret)
+
+    Args:
+        token: Encoded JWT from the Authorization header
+        secret: The project's JWT secret
+        audience: Required "aud" claim (Supabase uses "authenticated" for signed-in users)
+        leeway: Seconds of clock skew tolerated when checking expiry
+
+    Returns:
+        The token's claims
+
+    Raises:
+        AuthError: If the token is malformed, not signed with the secret, expired,
+            meant for another audience or has no subject
+    """
+    try:
+        header_segment, payload_segment, signature_segment = token.split('.')
+        header = json.loads(_b64decode(header_segment))
+        claims = json.loads(_b64decode(payload_segment))
+        signature = _b64decode(signature_segment)
+    except (ValueError, TypeError):
+        raise AuthError("Malformed access token")
+
+    # Only accept the algorithm we verify, never "none" or one chosen by the token
+    if not isinstance(header, dict) or header.get("alg") != "HS256" or not isinstance(claims, dict):
+        raise AuthError("Unsupported access token")
+
+    expected = hmac.new(secret.encode(), f"{header_segment}.{payload_segment}".encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise AuthError("Invalid access token signature")
+
+    now = time.time()
+    if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] < now - leeway:
+        raise AuthError("Access token has expired")
+    if isinstance(claims.get("nbf"), (int, float)) and claims["nbf"] > now + leeway:
+        raise AuthError("Access token is not valid yet")
+
+    token_audience = claims.get("aud")
+    if audience is not None and audience not in (token_audience if isinstance(token_audience, list) else [token_audience]):
+        raise AuthError("Access token is for another audience")
+    if not isinstance(claims.get("sub"), str) or not claims["sub"]:
+        raise AuthError("Access token has no subject")
+    return claims
@@ -0,0 +1,131 @@
+"""
+Bulk retinal screening from the command line
+
+Streams a directory (or list) of fundus images through batched inference and
+appends one JSON line per image to the output file. Re-running with the same
+output file skips images that already have a result.
+
+Usage:
+    python batch_analyze.py scans/ --output results.jsonl --batch-size 32
+"""
+import argparse
+import json
+import logging
+import os
+
+import analysis
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+def collect_image_paths(inputs):
+    """
+    Expand files and directories into a sorted list of image paths
+
+    Args:
+        inputs: Iterable of file or directory paths
+
+    Returns:
+        List of image file paths
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in files
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.append(item)
+    return sorted(paths)
+
+def load_completed(output_path):
+    """
+    Read the image paths that already have a result in a JSON Lines file
+
+    Args:
+        output_path: Path to the results file
+
+    Returns:
+        Set of completed image paths
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)["image_path"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                # A partial last line from an interrupted run is retried
+                continue
+    return completed
+
+def analyze_to_jsonl(detector, image_paths, output_path, batch_size=32, resume=True, workers=None):
+    """
+    Analyze images and append results to a JSON Lines file as they complete
+
+    Args:
+        detector: EyeDiseaseDetector instance
+        image_paths: List of image file paths
+        output_path: Path to the JSON Lines results file
+        batch_size: Number of images per model call
+        resume: Skip images already present in the output file
+        workers: Preprocessing worker processes (defaults to config)
+
+    Returns:
+        Dictionary with processed, skipped and error counts
+    """
+    completed = load_completed(output_path) if resume else set()
+    remaining = [path for path in image_paths if path not in completed]
+    summary = {"processed": 0, "skipped": len(image_paths) - len(remaining), "errors": 0}
+
+    mode = 'a' if resume else 'w'
+    with open(output_path, mode) as f:
+        # Terminate a partial line left behind by an interrupted run
+        if mode == 'a' and f.tell() > 0:
+            with open(output_path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b'\n':
+                    f.write('\n')
+
+        for image_path, result in detector.iter_analyze_batch(remaining, batch_size=batch_size, workers=workers):
+            f.write(json.dumps(dict(result, image_path=image_path)) + '\n')
+            summary["processed"] += 1
+            if "error" in result:
+                summary["errors"] += 1
+            # Flush every line so an interrupted run can resume from here
+            f.flush()
+
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch eye disease analysis of retinal images")
+    parser.add_argument('inputs', nargs='+', help="Image files and/or directories of images")
+    parser.add_argument('--output', '-o', default='results.jsonl', help="JSON Lines file to append results to")
+    parser.add_argument('--batch-size', type=int, default=32, help="Images per model call")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes for decoding/preprocessing (default: config, 0 disables)")
+    parser.add_argument('--model-path', default=analysis.DEFAULT_MODEL_PATH)
+    parser.add_argument('--config-path', default=analysis.DEFAULT_CONFIG_PATH)
+    parser.add_argument('--no-resume', action='store_true', help="Overwrite the output instead of resuming")
+    args = parser.parse_args(argv)
+
+    image_paths = collect_image_paths(args.inputs)
+    logger.info(f"Found {len(image_paths)} images")
+
+    detector = analysis.get_detector(model_path=args.model_path, config_path=args.config_path)
+    summary = analyze_to_jsonl(detector, image_paths, args.output,
+                               batch_size=args.batch_size, resume=not args.no_resume,
+                               workers=args.workers)
+
+    if detector.preprocess_pool is not None:
+        for stage, timing in detector.preprocess_pool.stats()["stages"].items():
+            logger.info(f"Stage {stage}: {timing['mean_ms']:.1f} ms/image")
+    logger.info(f"Processed {summary['processed']} images ({summary['errors']} errors), "
+                f"skipped {summary['skipped']} already analyzed. Results in {args.output}")
+    return summary
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import threading
+import queue
+import time
+import logging
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class BatcherStoppedError(RuntimeError):
+    """Raised for requests submitted to, or left queued in, a stopped batcher"""
+
+class _PendingRequest:
+    """Single caller waiting for predictions on its image array"""
+
+    __slots__ = ("array", "future", "enqueued_at")
+
+    def __init__(self, array):
+        self.array = array
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class InferenceBatcher:
+    """Dynamic micro-batching queue in front of a model's batch predict function"""
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10, delay_window=1000):
+        """
+        Initialize the batcher
+
+        Args:
+            predict_fn: Callable taking an (N, H, W, C) array and returning (N, classes) predictions
+            max_batch_size: Maximum number of images run in one model call
+            max_wait_ms: Maximum time the first queued image waits for others to join its batch
+            delay_window: Number of recent queueing delays kept for percentile reporting
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Guards _stopped together with enqueueing, so nothing is queued behind the stop sentinel
+        self._submit_lock = threading.Lock()
+        self._stopped = False
+
+        # Metrics
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._recent_delays = deque(maxlen=delay_window)
+        self._requests = 0
+        self._total_delay = 0.0
+        self._max_delay = 0.0
+
+    def _ensure_started(self):
+        """Start the worker thread on first use (keeps the batcher safe to create before forking)"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, img_array):
+        """
+        Queue an image array for batched inference
+
+        Args:
+            img_array: Model-ready array with a leading batch dimension
+
+        Returns:
+            Future resolving to the predictions for the submitted rows
+
+        Raises:
+            BatcherStoppedError: If the batcher has been stopped
+        """
+        request = _PendingRequest(img_array)
+        with self._submit_lock:
+            if self._stopped:
+                raise BatcherStoppedError("Inference batcher has been stopped")
+            self._ensure_started()
+            self._queue.put(request)
+        return request.future
+
+    def predict(self, img_array, timeout=None):
+        """
+        Run inference on an image array through the shared batch
+
+        Args:
+            img_array: Model-ready array with a leading batch dimension
+            timeout: Seconds to wait for the result (None waits indefinitely)
+
+        Returns:
+            Predictions for the submitted rows
+        """
+        return self.submit(img_array).result(timeout=timeout)
+
+    def stop(self):
+        """Stop the worker thread after the queued requests are served"""
+        with self._submit_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+
+        if thread is not None:
+            thread.join()
+            self._thread = None
+
+        # Nothing should be left, but a waiting caller must never hang on a request no thread will serve
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.future.set_exception(BatcherStoppedError("Inference batcher has been stopped"))
+
+    def _run(self):
+        """Worker loop: gather requests until the batch is full or the wait expires"""
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = [first]
+            rows = len(first.array)
+            deadline = first.enqueued_at + self.max_wait
+            stop_after = False
+
+            while rows < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop_after = True
+                    break
+                batch.append(request)
+                rows += len(request.array)
+
+            self._run_batch(batch, rows)
+
+            if stop_after:
+                break
+
+    def _run_batch(self, batch, rows):
+        """Run one model call for the gathered requests and fan the results back out"""
+        started = time.perf_counter()
+
+        with self._stats_lock:
+            self._batch_sizes[rows] += 1
+            for request in batch:
+                delay = started - request.enqueued_at
+                self._requests += 1
+                self._total_delay += delay
+                self._max_delay = max(self._max_delay, delay)
+                self._recent_delays.append(delay)
+
+        try:
+            inputs = np.concatenate([request.array for request in batch], axis=0)
+            predictions = self.predict_fn(inputs)
+        except Exception as e:
+            logger.error(f"Batched inference failed for {len(batch)} requests: {str(e)}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request in batch:
+            count = len(request.array)
+            request.future.set_result(predictions[offset:offset + count])
+            offset += count
+
+    def stats(self):
+        """
+        Summarize batching behaviour
+
+        Returns:
+            Dictionary with batch size distribution and queueing delay statistics (milliseconds)
+        """
+        with self._stats_lock:
+            delays = sorted(self._recent_delays)
+            batches = sum(self._batch_sizes.values())
+
+            def percentile(p):
+                if not delays:
+                    return 0.0
+                return delays[min(len(delays) - 1, int(p * len(delays)))] * 1000.0
+
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "requests": self._requests,
+                "batches": batches,
+                "mean_batch_size": (sum(size * count for size, count in self._batch_sizes.items()) / batches) if batches else 0.0,
+                "batch_size_distribution": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "queue_delay_ms": {
+                    "mean": (self._total_delay / self._requests * 1000.0) if self._requests else 0.0,
+                    "p50": percentile(0.50),
+                    "p95": percentile(0.95),
+                    "max": self._max_delay * 1000.0
+                }
+            }
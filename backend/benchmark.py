@@ -0,0 +1,432 @@
+"""
+End-to-end benchmark of the analysis pipeline
+
+Measures where the time goes in EyeDiseaseDetector.analyze on synthetic
+fundus images and the bundled samples at several resolutions:
+
+- per-stage latency: decode, each preprocessing step, prepare_for_model,
+  predict and post-processing
+- batched throughput (images/sec) at several batch sizes
+- peak resident memory after each scenario
+- optionally, an HTTP load test against /upload and /physicians
+
+Results are written as JSON so runs can be compared across commits with
+--baseline.
+
+Usage:
+    python benchmark.py --resolutions 512 1024 2048 --batch-sizes 1 8 32 --output bench.json
+    python benchmark.py --http --concurrency 8 --requests 200 --baseline bench-main.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import analysis
+from compare_preprocessing import DEFAULT_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+# Preprocessing steps on the inference path, in dependency order, then the
+# variants only computed when a caller asks for them
+INFERENCE_STEPS = ("green_channel", "gamma_corrected", "enhanced_green", "enhanced_color")
+EXTRA_STEPS = ("original", "rgb", "denoised", "vessel_enhanced")
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+def summarize(samples_ms):
+    """Mean and percentiles of a list of latencies in milliseconds"""
+    if not samples_ms:
+        return None
+    values = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+    }
+
+def synthetic_fundus(size, seed=0):
+    """
+    Generate a fundus-like test image: a bright disc with an optic disc,
+    branching dark vessels and sensor noise on a black background
+
+    Args:
+        size: Width and height in pixels
+        seed: Random seed (different seeds give different image bytes)
+
+    Returns:
+        BGR image of shape (size, size, 3)
+    """
+    cv2 = analysis.cv2
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+    center = (size // 2, size // 2)
+    cv2.circle(image, center, int(size * 0.45), (40, 80, 170), -1)
+
+    disc = (int(size * rng.uniform(0.3, 0.4)), int(size * rng.uniform(0.45, 0.55)))
+    cv2.circle(image, disc, int(size * 0.06), (150, 200, 240), -1)
+
+    for _ in range(12):
+        angle = rng.uniform(0, 2 * np.pi)
+        end = (int(disc[0] + np.cos(angle) * size * 0.4), int(disc[1] + np.sin(angle) * size * 0.4))
+        cv2.line(image, disc, end, (20, 40, 110), max(1, size // 200))
+
+    noise = rng.normal(0, 6, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+def encode_jpeg(image, quality=92):
+    ok, buffer = analysis.cv2.imencode('.jpg', image, [analysis.cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode benchmark image")
+    return buffer.tobytes()
+
+def build_images(resolutions, sample_paths, synthetic_count=2):
+    """
+    Build the encoded benchmark images
+
+    Args:
+        resolutions: Square sizes to render each image at
+        sample_paths: Real fundus images, resized to each resolution
+        synthetic_count: Synthetic images per resolution
+
+    Returns:
+        List of (name, resolution, JPEG bytes)
+    """
+    cv2 = analysis.cv2
+    samples = []
+    for path in sample_paths:
+        image = cv2.imread(path)
+        if image is None:
+            logger.warning(f"Skipping unreadable sample {path}")
+            continue
+        samples.append((os.path.splitext(os.path.basename(path))[0], image))
+
+    images = []
+    for size in resolutions:
+        for name, image in samples:
+            resized = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+            images.append((f"{name}@{size}", size, encode_jpeg(resized)))
+        for i in range(synthetic_count):
+            images.append((f"synthetic-{i}@{size}", size, encode_jpeg(synthetic_fundus(size, seed=i))))
+    return images
+
+def gated_images(detector, images):
+    """
+    Find the images the quality gate sends back for a retake
+
+    analyze() returns before inference for these, so their timings would
+    understate what an analysis costs.
+
+    Args:
+        detector: EyeDiseaseDetector to benchmark
+        images: List of (name, resolution, JPEG bytes)
+
+    Returns:
+        Set of the gated image names
+    """
+    config = detector.config
+    if not analysis.quality_gate_enabled(config):
+        return set()
+    return {name for name, _, data in images
+            if not analysis.assess_image_quality(analysis.decode_image_bytes(data, config)[0], config)["acceptable"]}
+
+def bench_stages(detector, images, repeat=3, gated=()):
+    """
+    Time each stage of analyze() separately
+
+    Args:
+        detector: EyeDiseaseDetector to benchmark
+        images: List of (name, resolution, JPEG bytes)
+        repeat: Runs per image
+        gated: Names of images the quality gate rejects; their analyze() time is
+            reported as analyze_total_retake instead of analyze_total
+
+    Returns:
+        Dictionary keyed by resolution, each mapping stage name to latency summary
+    """
+    config = detector.config
+    gate_enabled = analysis.quality_gate_enabled(config)
+    timings = {}
+    for name, size, data in images:
+        stages = timings.setdefault(size, {})
+        for _ in range(repeat):
+            start = time.perf_counter()
+            img, original_shape = analysis.decode_image_bytes(data, config)
+            stages.setdefault("decode", []).append((time.perf_counter() - start) * 1000.0)
+
+            if gate_enabled:
+                start = time.perf_counter()
+                analysis.assess_image_quality(img, config)
+                stages.setdefault("quality_gate", []).append((time.perf_counter() - start) * 1000.0)
+
+            processed = detector.preprocess_image(img)
+            for step in INFERENCE_STEPS + EXTRA_STEPS:
+                start = time.perf_counter()
+                processed[step]
+                stages.setdefault(f"preprocess.{step}", []).append((time.perf_counter() - start) * 1000.0)
+
+            # prepare_for_model only reads the cached enhanced_color, so this is the resize/normalize cost
+            start = time.perf_counter()
+            img_array = detector.prepare_for_model(processed)
+            stages.setdefault("prepare", []).append((time.perf_counter() - start) * 1000.0)
+
+            start = time.perf_counter()
+            raw_predictions = detector._predict_batch(img_array)[0]
+            stages.setdefault("predict", []).append((time.perf_counter() - start) * 1000.0)
+
+            start = time.perf_counter()
+            detector._build_result(raw_predictions, *original_shape)
+            stages.setdefault("postprocess", []).append((time.perf_counter() - start) * 1000.0)
+
+            # What a request actually pays: the inference-path preprocessing steps only
+            start = time.perf_counter()
+            detector.analyze(data)
+            total = "analyze_total_retake" if name in gated else "analyze_total"
+            stages.setdefault(total, []).append((time.perf_counter() - start) * 1000.0)
+
+    return {str(size): {stage: summarize(samples) for stage, samples in stages.items()}
+            for size, stages in timings.items()}
+
+def bench_throughput(detector, images, batch_sizes, rounds=2, gated=()):
+    """
+    Measure batched throughput of analyze_batch at several batch sizes
+
+    Args:
+        detector: EyeDiseaseDetector to benchmark
+        images: List of (name, resolution, JPEG bytes)
+        batch_sizes: Batch sizes to try
+        rounds: Passes over the images per batch size
+        gated: Names of images the quality gate rejects, left out of the workload
+
+    Returns:
+        Dictionary keyed by resolution and batch size with images/sec and peak RSS
+    """
+    by_size = {}
+    for name, size, data in images:
+        if name not in gated:
+            by_size.setdefault(size, []).append((name, data))
+
+    results = {}
+    for size, items in by_size.items():
+        for batch_size in batch_sizes:
+            # Repeat the images so every batch is full
+            workload = (items * (batch_size // len(items) + 1))[:max(batch_size, len(items))] * rounds
+            start = time.perf_counter()
+            detector.analyze_batch(workload, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            results.setdefault(str(size), {})[str(batch_size)] = {
+                "images": len(workload),
+                "images_per_sec": len(workload) / elapsed if elapsed else None,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+            logger.info(f"{size}px batch {batch_size}: {len(workload) / elapsed:.1f} images/sec")
+    return results
+
+def _timed_request(request):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+            ok = 200 <= response.status < 300
+    except Exception:
+        ok = False
+    return (time.perf_counter() - start) * 1000.0, ok
+
+def run_load(make_request, total, concurrency):
+    """
+    Send requests from a pool of client threads
+
+    Args:
+        make_request: Callable i -> urllib Request for the i-th request
+        total: Number of requests
+        concurrency: Concurrent client threads
+
+    Returns:
+        Dictionary with requests/sec, error count and latency summary
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda i: _timed_request(make_request(i)), range(total)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "requests_per_sec": total / elapsed if elapsed else None,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "latency_ms": summarize([ms for ms, _ in outcomes]),
+    }
+
+def _start_local_server(detector):
+    """Serve the Flask app with the benchmarked detector on a free local port in a background thread"""
+    from werkzeug.serving import make_server
+    import server
+
+    # The app looks its detector up under the default paths; serve the one given
+    # by --model-path/--config-path instead of loading the default model again
+    analysis.register_detector(detector)
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="benchmark-server", daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_port}"
+
+def bench_http(base_url, upload_size, total, concurrency):
+    """
+    Load-test /upload and /physicians
+
+    Uploads are distinct synthetic images so the result cache does not hide inference cost.
+
+    Args:
+        base_url: Server URL, e.g. http://127.0.0.1:5000
+        upload_size: Resolution of the uploaded images
+        total: Requests per endpoint
+        concurrency: Concurrent clients
+
+    Returns:
+        Dictionary with a load summary per endpoint
+    """
+    uploads = [encode_jpeg(synthetic_fundus(upload_size, seed=1000 + i)) for i in range(total)]
+    queries = [("Glaucoma", "California"), ("Cataracts", ""), ("Diabetic Retinopathy", "Texas"), ("", "New York")]
+
+    def upload_request(i):
+        return urllib.request.Request(f"{base_url}/upload", data=uploads[i], method='POST',
+                                      headers={'Content-Type': 'image/jpeg'})
+
+    def physicians_request(i):
+        disease, state = queries[i % len(queries)]
+        query = urllib.parse.urlencode({"disease": disease, "state": state, "limit": 20})
+        return urllib.request.Request(f"{base_url}/physicians?{query}")
+
+    # One request first so model loading is not counted as latency
+    _timed_request(upload_request(0))
+    return {
+        "upload": run_load(upload_request, total, concurrency),
+        "physicians": run_load(physicians_request, total, concurrency),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _flatten(value, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}, keeping numeric leaves only"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}{key}."))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+def compare_to_baseline(results, baseline):
+    """
+    Relative change of every latency, throughput and memory metric against a previous run
+
+    Returns:
+        Dictionary of metric path -> {"baseline", "current", "change"} (change as a fraction)
+    """
+    current = _flatten({key: results[key] for key in ("stages", "throughput", "http") if key in results})
+    previous = _flatten({key: baseline[key] for key in ("stages", "throughput", "http") if key in baseline})
+    return {
+        metric: {"baseline": previous[metric], "current": value,
+                 "change": (value - previous[metric]) / previous[metric] if previous[metric] else None}
+        for metric, value in current.items()
+        if metric in previous and not metric.endswith(".count")
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the eye disease analysis pipeline")
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--samples', nargs='*', default=None, help="Real images to include (default: bundled samples)")
+    parser.add_argument('--synthetic', type=int, default=2, help="Synthetic images per resolution")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per image for the stage breakdown")
+    parser.add_argument('--model-path', default=analysis.DEFAULT_MODEL_PATH)
+    parser.add_argument('--config-path', default=analysis.DEFAULT_CONFIG_PATH)
+    parser.add_argument('--http', action='store_true', help="Also load-test /upload and /physicians")
+    parser.add_argument('--url', default=None, help="Server to load-test (default: start one in-process)")
+    parser.add_argument('--requests', type=int, default=100, help="Requests per endpoint in the HTTP scenario")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--upload-size', type=int, default=1024, help="Resolution of uploaded images")
+    parser.add_argument('--output', '-o', default=None, help="Write the results as JSON")
+    parser.add_argument('--baseline', default=None, help="Previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    detector = analysis.EyeDiseaseDetector(model_path=args.model_path, config_path=args.config_path)
+    # Every repeat must hit the model, not the result cache
+    detector.result_cache = None
+    detector.warmup()
+
+    images = build_images(args.resolutions, args.samples if args.samples is not None else DEFAULT_SAMPLES,
+                          synthetic_count=args.synthetic)
+    logger.info(f"Benchmarking {len(images)} images at {args.resolutions}")
+    gated = gated_images(detector, images)
+    if gated:
+        logger.info(f"Quality gate rejects {len(gated)} images; timing them separately: {sorted(gated)}")
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "inference_backend": detector.backend.name if detector.backend is not None else None,
+            "model_version": detector.version,
+            "preprocessing_mode": detector.config.get("preprocessing", {}).get("mode", "full"),
+            "load_time": detector.load_time,
+            "warmup_time": detector.warmup_time,
+            "gated_images": sorted(gated),
+        },
+        "stages": bench_stages(detector, images, repeat=args.repeat, gated=gated),
+    }
+    results["stages_peak_rss_mb"] = peak_rss_mb()
+    results["throughput"] = bench_throughput(detector, images, args.batch_sizes, gated=gated)
+
+    if args.http:
+        httpd = None
+        base_url = args.url
+        if base_url is None:
+            httpd, base_url = _start_local_server(detector)
+        try:
+            results["http"] = bench_http(base_url, args.upload_size, args.requests, args.concurrency)
+        finally:
+            if httpd is not None:
+                httpd.shutdown()
+        results["http_peak_rss_mb"] = peak_rss_mb()
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            results["comparison"] = compare_to_baseline(results, json.load(f))
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Benchmark results written to {args.output}")
+
+    return results
+
+if __name__ == '__main__':
+    main()
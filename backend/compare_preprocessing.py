@@ -0,0 +1,130 @@
+"""
+Accuracy/latency comparison of the "full" and "fast" preprocessing modes
+
+Runs each sample image through load_image -> preprocess -> prepare_for_model
+in both modes, reports the time per image and how far the fast-mode model
+input drifts from the full-resolution one. When a trained model is
+available, the predictions of both modes are compared as well.
+
+Usage:
+    python compare_preprocessing.py [images or directories ...] --repeat 3 --output comparison.json
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+import analysis
+from batch_analyze import collect_image_paths
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'images', name)
+    for name in ('good-retinal-sample.jpg', 'poor-retinal-sample.jpg')
+]
+
+def _prepare(image_path, config):
+    """Load and prepare one image, returning (model input, seconds taken)"""
+    start = time.perf_counter()
+    img, _ = analysis.load_image(image_path, config)
+    if img is None:
+        raise ValueError(f"Could not read image at {image_path}")
+    img_array = analysis.prepare_model_input(analysis.preprocess_retinal_image(img, config), config)
+    return img_array, time.perf_counter() - start
+
+def compare(image_paths, config, detector=None, repeat=3):
+    """
+    Compare the full and fast preprocessing modes on a set of images
+
+    Args:
+        image_paths: List of image file paths
+        config: Base model configuration dictionary
+        detector: Optional EyeDiseaseDetector used to compare predictions
+        repeat: Timed runs per image and mode (the fastest run is kept)
+
+    Returns:
+        Dictionary with per-image rows and an overall summary
+    """
+    configs = {}
+    for mode in ("full", "fast"):
+        configs[mode] = copy.deepcopy(config)
+        configs[mode].setdefault("preprocessing", {})["mode"] = mode
+
+    rows = []
+    for image_path in image_paths:
+        row = {"image_path": image_path}
+        arrays = {}
+        for mode, mode_config in configs.items():
+            timings = []
+            for _ in range(max(1, repeat)):
+                arrays[mode], seconds = _prepare(image_path, mode_config)
+                timings.append(seconds)
+            row[f"{mode}_ms"] = min(timings) * 1000.0
+
+        row["speedup"] = row["full_ms"] / row["fast_ms"] if row["fast_ms"] else None
+        row["input_mean_abs_diff"] = float(np.mean(np.abs(arrays["full"] - arrays["fast"])))
+        row["input_correlation"] = float(np.corrcoef(arrays["full"].ravel(), arrays["fast"].ravel())[0, 1])
+
+        if detector is not None and detector.backend is not None:
+            predictions = {mode: detector._predict_batch(array)[0] for mode, array in arrays.items()}
+            row["max_probability_diff"] = float(np.max(np.abs(predictions["full"] - predictions["fast"])))
+            row["same_top_prediction"] = bool(np.argmax(predictions["full"]) == np.argmax(predictions["fast"]))
+
+        rows.append(row)
+        logger.info(f"{os.path.basename(image_path)}: full {row['full_ms']:.1f} ms, fast {row['fast_ms']:.1f} ms, "
+                    f"input diff {row['input_mean_abs_diff']:.4f}")
+
+    summary = {
+        "images": len(rows),
+        "mean_full_ms": float(np.mean([row["full_ms"] for row in rows])) if rows else 0.0,
+        "mean_fast_ms": float(np.mean([row["fast_ms"] for row in rows])) if rows else 0.0,
+        "mean_input_abs_diff": float(np.mean([row["input_mean_abs_diff"] for row in rows])) if rows else 0.0,
+    }
+    if rows and "same_top_prediction" in rows[0]:
+        summary["top_prediction_agreement"] = float(np.mean([row["same_top_prediction"] for row in rows]))
+        summary["max_probability_diff"] = float(max(row["max_probability_diff"] for row in rows))
+
+    return {"rows": rows, "summary": summary}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare full and fast preprocessing modes")
+    parser.add_argument('inputs', nargs='*', help="Image files and/or directories (default: bundled samples)")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per image and mode")
+    parser.add_argument('--working-size', type=int, default=None, help="Override the fast-mode working size")
+    parser.add_argument('--model-path', default=analysis.DEFAULT_MODEL_PATH)
+    parser.add_argument('--config-path', default=analysis.DEFAULT_CONFIG_PATH)
+    parser.add_argument('--no-model', action='store_true', help="Only compare preprocessing, skip predictions")
+    parser.add_argument('--output', '-o', default=None, help="Write the comparison as JSON")
+    args = parser.parse_args(argv)
+
+    image_paths = collect_image_paths(args.inputs or DEFAULT_SAMPLES)
+
+    if args.no_model or not os.path.exists(args.model_path):
+        # Without trained weights the predictions are meaningless, so only compare inputs
+        detector = None
+        config = analysis.load_config(args.config_path)
+    else:
+        detector = analysis.get_detector(model_path=args.model_path, config_path=args.config_path)
+        config = detector.config
+
+    if args.working_size is not None:
+        config = copy.deepcopy(config)
+        config.setdefault("preprocessing", {})["working_size"] = args.working_size
+
+    comparison = compare(image_paths, config, detector=detector, repeat=args.repeat)
+    print(json.dumps(comparison["summary"], indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(comparison, f, indent=2)
+        logger.info(f"Comparison written to {args.output}")
+
+    return comparison
+
+if __name__ == '__main__':
+    main()
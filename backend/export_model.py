@@ -0,0 +1,247 @@
+"""
+Export the trained Keras model to a lightweight inference format
+
+Converts the .h5 model to TFLite or ONNX, optionally with float16 or int8
+post-training quantization. Int8 quantization is calibrated on retinal
+images run through the same preprocessing as inference. After export, the
+converted model is checked against the Keras outputs so accuracy drift is
+caught before it is deployed.
+
+To serve the exported model, set "inference_backend" in the model config:
+    {"inference_backend": {"type": "tflite", "path": "models/eye_disease_model.int8.tflite"}}
+
+Usage:
+    python export_model.py --format tflite --quantize int8 --calibration scans/ --max-drift 0.05
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import analysis
+from batch_analyze import collect_image_paths
+from compare_preprocessing import DEFAULT_SAMPLES
+from inference_backends import create_backend
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("tflite", "onnx")
+QUANTIZATIONS = ("none", "float16", "int8")
+
+def default_output_path(model_path, fmt, quantize):
+    """models/eye_disease_model.h5 -> models/eye_disease_model.int8.tflite"""
+    base = os.path.splitext(model_path)[0]
+    suffix = "" if quantize == "none" else f".{quantize}"
+    return f"{base}{suffix}.{fmt}"
+
+def load_calibration_inputs(image_paths, config):
+    """
+    Preprocess calibration images exactly as inference does
+
+    Args:
+        image_paths: List of image file paths
+        config: Model configuration dictionary
+
+    Returns:
+        List of model inputs of shape (1, height, width, 3)
+    """
+    inputs = []
+    for image_path in image_paths:
+        img, _ = analysis.load_image(image_path, config)
+        if img is None:
+            logger.warning(f"Skipping unreadable calibration image {image_path}")
+            continue
+        inputs.append(analysis.prepare_model_input(analysis.preprocess_retinal_image(img, config), config)
+                      .astype(np.float32))
+    if not inputs:
+        raise ValueError("No readable calibration images")
+    return inputs
+
+def calibration_samples(inputs, count):
+    """
+    Yield count calibration inputs, cycling through flips of the images when
+    there are fewer images than samples requested
+
+    Args:
+        inputs: List of prepared model inputs
+        count: Number of samples to yield
+
+    Yields:
+        Model inputs of shape (1, height, width, 3)
+    """
+    variants = (
+        lambda x: x,
+        lambda x: x[:, :, ::-1, :],
+        lambda x: x[:, ::-1, :, :],
+        lambda x: x[:, ::-1, ::-1, :],
+    )
+    for i in range(count):
+        sample = inputs[i % len(inputs)]
+        yield np.ascontiguousarray(variants[(i // len(inputs)) % len(variants)](sample))
+
+def export_tflite(model, output_path, quantize, calibration_inputs=None, calibration_size=100):
+    """
+    Convert a Keras model to a TFLite flatbuffer
+
+    Args:
+        model: Keras model
+        output_path: Destination .tflite file
+        quantize: "none", "float16" or "int8"
+        calibration_inputs: Prepared inputs used to calibrate int8 activation ranges
+        calibration_size: Number of calibration samples fed to the converter
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([sample] for sample in
+                                                    calibration_samples(calibration_inputs, calibration_size))
+        # Weights and activations in int8; input and output stay float32 so callers need no changes
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+class _CalibrationReader:
+    """onnxruntime.quantization calibration data reader over prepared inputs"""
+
+    def __init__(self, input_name, inputs, count):
+        self._samples = ({input_name: sample} for sample in calibration_samples(inputs, count))
+
+    def get_next(self):
+        return next(self._samples, None)
+
+def export_onnx(model, output_path, quantize, calibration_inputs=None, calibration_size=100, opset=13):
+    """
+    Convert a Keras model to ONNX (requires tf2onnx)
+
+    Args:
+        model: Keras model
+        output_path: Destination .onnx file
+        quantize: "none", "float16" or "int8"
+        calibration_inputs: Prepared inputs used to calibrate int8 activation ranges
+        calibration_size: Number of calibration samples fed to the quantizer
+        opset: ONNX opset version
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    input_signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name="input")]
+
+    if quantize == "none":
+        tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset, output_path=output_path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        float_path = os.path.join(tmp_dir, "model.onnx")
+        onnx_model, _ = tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset,
+                                                   output_path=float_path)
+        if quantize == "float16":
+            import onnx
+            from onnxconverter_common import float16
+            onnx.save(float16.convert_float_to_float16(onnx_model, keep_io_types=True), output_path)
+        else:
+            from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+            reader = _CalibrationReader(onnx_model.graph.input[0].name, calibration_inputs, calibration_size)
+            quantize_static(float_path, output_path, reader, quant_format=QuantFormat.QDQ,
+                            activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+
+def _mean_latency_ms(predict_fn, inputs):
+    predict_fn(inputs[0])
+    start = time.perf_counter()
+    for img_array in inputs:
+        predict_fn(img_array)
+    return (time.perf_counter() - start) * 1000.0 / len(inputs)
+
+def check_drift(model, backend, inputs):
+    """
+    Compare the exported model's predictions with the Keras model's
+
+    Args:
+        model: Reference Keras model
+        backend: Inference backend of the exported model
+        inputs: List of prepared model inputs
+
+    Returns:
+        Dictionary with probability drift, top-1 agreement and latency of both models
+    """
+    reference = np.concatenate([np.asarray(model(img_array, training=False)) for img_array in inputs])
+    exported = np.concatenate([backend.predict(img_array) for img_array in inputs])
+    diff = np.abs(reference - exported)
+
+    return {
+        "images": len(inputs),
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "top1_agreement": float(np.mean(np.argmax(reference, axis=1) == np.argmax(exported, axis=1))),
+        "keras_ms": _mean_latency_ms(lambda x: model(x, training=False), inputs),
+        "exported_ms": _mean_latency_ms(backend.predict, inputs),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the Keras model to TFLite or ONNX")
+    parser.add_argument('--format', choices=FORMATS, default="tflite")
+    parser.add_argument('--quantize', choices=QUANTIZATIONS, default="none")
+    parser.add_argument('--calibration', nargs='*', default=None,
+                        help="Calibration images and/or directories (default: bundled samples)")
+    parser.add_argument('--calibration-size', type=int, default=100, help="Calibration samples for int8")
+    parser.add_argument('--model-path', default=analysis.DEFAULT_MODEL_PATH)
+    parser.add_argument('--config-path', default=analysis.DEFAULT_CONFIG_PATH)
+    parser.add_argument('--output', '-o', default=None, help="Exported model path (default: next to the .h5)")
+    parser.add_argument('--no-check', action='store_true', help="Skip the accuracy-drift check")
+    parser.add_argument('--max-drift', type=float, default=None,
+                        help="Fail if any probability differs from Keras by more than this")
+    parser.add_argument('--report', default=None, help="Write the drift report as JSON")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.model_path):
+        parser.error(f"No trained model found at {args.model_path}")
+
+    from tensorflow.keras.models import load_model
+
+    config = analysis.load_config(args.config_path)
+    model = load_model(args.model_path, compile=False)
+    output_path = args.output or default_output_path(args.model_path, args.format, args.quantize)
+    inputs = load_calibration_inputs(collect_image_paths(args.calibration or DEFAULT_SAMPLES), config)
+
+    start = time.perf_counter()
+    exporter = export_tflite if args.format == "tflite" else export_onnx
+    exporter(model, output_path, args.quantize, calibration_inputs=inputs, calibration_size=args.calibration_size)
+    logger.info(f"Exported {args.format} ({args.quantize}) model to {output_path} "
+                f"in {time.perf_counter() - start:.1f}s")
+
+    report = {
+        "model_path": args.model_path,
+        "output_path": output_path,
+        "format": args.format,
+        "quantize": args.quantize,
+        "keras_bytes": os.path.getsize(args.model_path),
+        "exported_bytes": os.path.getsize(output_path),
+    }
+
+    if not args.no_check:
+        report["drift"] = check_drift(model, create_backend(args.format, output_path), inputs)
+    print(json.dumps(report, indent=2))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Export report written to {args.report}")
+
+    if args.max_drift is not None and "drift" in report and report["drift"]["max_abs_diff"] > args.max_drift:
+        logger.error(f"Exported model drifts by {report['drift']['max_abs_diff']:.4f} "
+                     f"(limit {args.max_drift}). Do not deploy it.")
+        raise SystemExit(1)
+
+    return report
+
+if __name__ == '__main__':
+    main()
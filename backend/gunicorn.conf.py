@@ -0,0 +1,61 @@
+"""
+Gunicorn settings for serving the API with several worker processes
+
+The app's modules are imported once in the master process before the workers
+are forked. The model is not: TensorFlow's thread pools and the TFLite/ONNX
+interpreters do not survive a fork, so each worker loads its own copy after it
+starts (see post_worker_init).
+
+Each worker handles requests on a pool of threads. Analyses are handed to the
+inference executor in server.py, so a burst of uploads never ties up every
+thread and I/O-bound routes like /physicians stay responsive. Idle keep-alive
+connections are held by the worker's event loop without occupying a thread.
+
+Usage:
+    python serve.py
+    gunicorn -c gunicorn.conf.py server:app
+"""
+import os
+import shutil
+import tempfile
+
+# Each worker keeps its metrics here so /metrics can report the sum over all workers
+os.environ.setdefault("OCULARE_METRICS_DIR", os.path.join(tempfile.gettempdir(), f"oculare-metrics-{os.getpid()}"))
+
+bind = os.environ.get("OCULARE_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("OCULARE_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("OCULARE_THREADS", "8"))
+# Open connections per worker, including idle keep-alive ones; further clients wait in the listen backlog
+worker_connections = int(os.environ.get("OCULARE_MAX_CONNECTIONS", "200"))
+# Seconds an idle keep-alive connection is kept open for the client's next request
+keepalive = int(os.environ.get("OCULARE_KEEPALIVE", "5"))
+# Imports only; nothing in the master touches the model
+preload_app = True
+# The model loads on a background thread in each worker, so only request handling counts against this
+timeout = int(os.environ.get("OCULARE_WORKER_TIMEOUT", "120"))
+
+def on_starting(arbiter):
+    # Runs once in the master, before any worker can pick up an async job
+    import metrics
+    import server
+    server.recover_interrupted_jobs()
+    metrics.clear_multiprocess_dir()
+
+def post_worker_init(worker):
+    # Runs in each worker after the fork, so the model and its thread pools belong to this process
+    import metrics
+    import server
+    metrics.start_multiprocess_flush()
+    if server.PRELOAD_MODEL:
+        server.start_model_loading()
+
+def child_exit(server, worker):
+    # Runs in the master; the worker's counters still count, its gauges no longer do
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+def on_exit(server):
+    import metrics
+    if metrics.MULTIPROCESS_DIR is not None:
+        shutil.rmtree(metrics.MULTIPROCESS_DIR, ignore_errors=True)
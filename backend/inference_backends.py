@@ -0,0 +1,227 @@
+import os
+import threading
+
+import numpy as np
+
+class KerasBackend:
+    """Runs predictions with the in-process Keras model"""
+
+    name = "keras"
+
+    def __init__(self, model, model_path=None):
+        self.model = model
+        self.model_path = model_path
+
+    def predict(self, batch):
+        # Calling the model directly avoids the per-call overhead of predict() for small batches
+        return np.asarray(self.model(np.asarray(batch, dtype=np.float32), training=False))
+
+def _load_tflite_interpreter(model_path, num_threads):
+    """Create a TFLite interpreter, preferring the standalone runtimes over full TensorFlow"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+class TFLiteBackend:
+    """Runs predictions with a TFLite flatbuffer (float32, float16 or int8 quantized)"""
+
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.interpreter = _load_tflite_interpreter(model_path, num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        # The interpreter holds its tensors in place, so calls must not overlap
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        self.interpreter.resize_tensor_input(self._input['index'], [batch_size] + list(self._input['shape'][1:]))
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._resize(batch.shape[0])
+
+            # Fully integer models take quantized input
+            if self._input['dtype'] in (np.int8, np.uint8):
+                scale, zero_point = self._input['quantization']
+                batch = np.clip(np.round(batch / scale + zero_point),
+                                np.iinfo(self._input['dtype']).min,
+                                np.iinfo(self._input['dtype']).max).astype(self._input['dtype'])
+
+            self.interpreter.set_tensor(self._input['index'], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output['index'])
+
+            if self._output['dtype'] in (np.int8, np.uint8):
+                scale, zero_point = self._output['quantization']
+                output = (output.astype(np.float32) - zero_point) * scale
+            return np.array(output, dtype=np.float32)
+
+class ONNXBackend:
+    """Runs predictions with ONNX Runtime on CPU"""
+
+    name = "onnx"
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+
+        self.model_path = model_path
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+BACKENDS = {
+    "tflite": TFLiteBackend,
+    "onnx": ONNXBackend,
+}
+
+def create_backend(backend_type, model_path, num_threads=None):
+    """
+    Create a lightweight inference backend for an exported model
+
+    Args:
+        backend_type: "tflite" or "onnx"
+        model_path: Path to the exported model file
+        num_threads: CPU threads used by the runtime (None for its default)
+
+    Returns:
+        Backend instance exposing predict(batch) -> (N, classes) array
+    """
+    if backend_type not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend_type}'. Expected one of {sorted(BACKENDS)}.")
+    return BACKENDS[backend_type](model_path, num_threads=num_threads)
+
+def load_backend(model_path, num_threads=None):
+    """
+    Load a model file with the backend matching its extension
+
+    Args:
+        model_path: Keras (.h5/.keras), TFLite (.tflite) or ONNX (.onnx) model
+        num_threads: CPU threads used by lightweight runtimes
+
+    Returns:
+        Backend instance
+    """
+    extension = os.path.splitext(model_path)[1].lower()
+    if extension in ('.tflite', '.onnx'):
+        return create_backend(extension[1:], model_path, num_threads=num_threads)
+
+    import tensorflow as tf
+    return KerasBackend(tf.keras.models.load_model(model_path, compile=False), model_path)
+
+# Test-time augmentations of a batch of prepared images (N, height, width, 3)
+AUGMENTATIONS = {
+    "identity": lambda batch: batch,
+    "hflip": lambda batch: batch[:, :, ::-1],
+    "vflip": lambda batch: batch[:, ::-1],
+    "rot90": lambda batch: np.rot90(batch, 1, axes=(1, 2)),
+    "rot180": lambda batch: batch[:, ::-1, ::-1],
+    "rot270": lambda batch: np.rot90(batch, 3, axes=(1, 2)),
+}
+
+def _fuse_keras_members(members):
+    """Combine Keras models into one model returning (N, members, classes), so they run in one call"""
+    import tensorflow as tf
+
+    models = [member.model for member in members]
+    for i, model in enumerate(models):
+        # Copies of one checkpoint share a name, which a functional model does not allow
+        try:
+            model.name = f"ensemble_member_{i}"
+        except AttributeError:
+            model._name = f"ensemble_member_{i}"
+
+    inputs = tf.keras.Input(shape=models[0].input_shape[1:])
+    outputs = [tf.keras.layers.Reshape((1, -1))(model(inputs)) for model in models]
+    fused = tf.keras.models.Model(inputs, tf.keras.layers.Concatenate(axis=1)(outputs))
+    return KerasBackend(fused)
+
+class EnsembleBackend:
+    """
+    Runs every test-time augmentation of a batch through every ensemble member
+
+    All augmentations are stacked into one batch. Keras members are fused
+    into a single model, so an all-Keras ensemble is one inference call;
+    TFLite/ONNX members get one call each over the stacked batch.
+    """
+
+    name = "ensemble"
+
+    def __init__(self, members, augmentations=("identity",), max_passes=None):
+        """
+        Args:
+            members: Backends of the ensemble members (the primary model first)
+            augmentations: Names from AUGMENTATIONS applied to each image
+            max_passes: Budget of forward passes per image (members x augmentations);
+                augmentations are dropped first, then members, to stay within it
+        """
+        unknown = [name for name in augmentations if name not in AUGMENTATIONS]
+        if unknown:
+            raise ValueError(f"Unknown augmentations {unknown}. Expected some of {sorted(AUGMENTATIONS)}.")
+
+        members = list(members)
+        augmentations = list(augmentations) or ["identity"]
+        if max_passes is not None:
+            while len(members) * len(augmentations) > max_passes and len(augmentations) > 1:
+                augmentations.pop()
+            while len(members) * len(augmentations) > max_passes and len(members) > 1:
+                members.pop()
+
+        self.members = members
+        self.augmentations = augmentations
+        self.passes = len(members) * len(augmentations)
+        self.model_path = members[0].model_path
+
+        self._keras_indices = [i for i, member in enumerate(members) if isinstance(member, KerasBackend)]
+        self._fused = None
+        if len(self._keras_indices) > 1:
+            self._fused = _fuse_keras_members([members[i] for i in self._keras_indices])
+
+    def predict_passes(self, batch):
+        """
+        Predict every augmentation of every image with every member
+
+        Args:
+            batch: Array of shape (N, height, width, 3)
+
+        Returns:
+            Array of shape (N, passes, classes)
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        stacked = np.concatenate([AUGMENTATIONS[name](batch) for name in self.augmentations], axis=0)
+
+        if self._fused is not None:
+            fused_outputs = self._fused.predict(stacked)
+            per_member = {index: fused_outputs[:, j] for j, index in enumerate(self._keras_indices)}
+        else:
+            per_member = {}
+        outputs = np.stack([per_member[i] if i in per_member else member.predict(stacked)
+                            for i, member in enumerate(self.members)], axis=1)
+
+        # (augmentations * N, members, classes) -> (N, augmentations * members, classes)
+        augmentation_count, size = len(self.augmentations), batch.shape[0]
+        outputs = outputs.reshape(augmentation_count, size, len(self.members), -1).transpose(1, 0, 2, 3)
+        return outputs.reshape(size, self.passes, -1)
+
+    def predict(self, batch):
+        return self.predict_passes(batch).mean(axis=1)
@@ -0,0 +1,353 @@
+import ipaddress
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+
+class CallbackURLError(ValueError):
+    """Raised for a callback URL the server must not send requests to"""
+
+def validate_callback_url(url, allowed_hosts=()):
+    """
+    Check that a callback URL points at a public http(s) host
+
+    Callbacks are sent from inside the server, so URLs resolving to loopback,
+    private, link-local (cloud metadata) or other non-public addresses are
+    refused unless their host is explicitly allowed.
+
+    Args:
+        url: Callback URL given by the client
+        allowed_hosts: Host names accepted without the address check
+
+    Raises:
+        CallbackURLError: If the URL must not be called
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise CallbackURLError("callback_url must be an http(s) URL")
+
+    host = parsed.hostname.lower()
+    if host in allowed_hosts:
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError):
+        raise CallbackURLError("callback_url host could not be resolved")
+
+    for address in addresses:
+        # Drop any IPv6 zone id (fe80::1%eth0) before parsing
+        if not ipaddress.ip_address(address.split('%', 1)[0]).is_global:
+            raise CallbackURLError("callback_url must point to a public address")
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Refuse redirects, which could lead a validated callback to an internal address"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+_callback_opener = urllib.request.build_opener(_NoRedirectHandler)
+
+class JobStore:
+    """SQLite-backed store of asynchronous analysis jobs"""
+
+    def __init__(self, db_path, retention_seconds=24 * 60 * 60):
+        """
+        Open (or create) the job database
+
+        Args:
+            db_path: Path to the SQLite file
+            retention_seconds: Finished jobs older than this are purged
+        """
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                callback_url TEXT,
+                result TEXT,
+                error TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+        self.purge_expired()
+
+    def fail_interrupted(self):
+        """
+        Mark jobs left queued or running by a previous server as failed
+
+        Payloads are not persisted, so jobs cut off by a restart can never
+        finish. Call this once per server start, before any worker takes jobs:
+        worker processes share the database, so the unfinished jobs a worker
+        sees may still be running in another one.
+
+        Returns:
+            Number of jobs marked as failed
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status IN (?, ?)",
+                (FAILED, "Interrupted by a server restart.", time.time(), QUEUED, RUNNING)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def create(self, job_id, callback_url=None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, created_at, updated_at, callback_url) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, now, now, callback_url)
+            )
+
+    def update(self, job_id, status, result=None, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        """
+        Look up a job
+
+        Args:
+            job_id: Job identifier
+
+        Returns:
+            Job dictionary, or None if the job does not exist
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, created_at, updated_at, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        job = {"job_id": row[0], "status": row[1], "created_at": row[2], "updated_at": row[3]}
+        if row[4] is not None:
+            job["analysis_result"] = json.loads(row[4])
+        if row[5] is not None:
+            job["error"] = row[5]
+        return job
+
+    def purge_expired(self):
+        """Delete finished jobs past the retention period"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (COMPLETED, FAILED, now - self.retention_seconds)
+            )
+            self._last_purge = now
+
+    def purge_if_due(self, interval=60 * 60):
+        if time.time() - self._last_purge > interval:
+            self.purge_expired()
+
+class JobQueue:
+    """Bounded pool of workers running analysis jobs in the background"""
+
+    def __init__(self, store, worker_fn, workers=2, max_queued=32, callback_timeout=10, callback_workers=2,
+                 allowed_callback_hosts=()):
+        """
+        Initialize the queue
+
+        Args:
+            store: JobStore used to track job status and results
+            worker_fn: Callable run for each job payload, returning a result dictionary
+            workers: Number of jobs run concurrently
+            max_queued: Jobs allowed to wait for a worker before submissions are rejected
+            callback_timeout: Seconds allowed for a result callback request
+            callback_workers: Threads sending result callbacks, separate from the analysis workers
+            allowed_callback_hosts: Callback hosts exempt from the public-address check
+        """
+        self.store = store
+        self.worker_fn = worker_fn
+        self.workers = workers
+        self.max_queued = max_queued
+        self.callback_timeout = callback_timeout
+        self.allowed_callback_hosts = frozenset(host.lower() for host in allowed_callback_hosts)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis-job")
+        # Slow callback receivers must not hold up analysis threads
+        self._callback_executor = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix="job-callback")
+        # One slot per job that is running or waiting; this is the backpressure limit
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+        self._counts_lock = threading.Lock()
+        self._counts = {QUEUED: 0, RUNNING: 0, COMPLETED: 0, FAILED: 0, "rejected": 0}
+
+    def submit(self, payload, callback_url=None):
+        """
+        Queue a payload for analysis
+
+        Args:
+            payload: Argument passed to worker_fn
+            callback_url: Optional URL that receives the finished job as a JSON POST
+
+        Returns:
+            New job id
+
+        Raises:
+            CallbackURLError: If callback_url is not an allowed http(s) URL
+            QueueFullError: If every worker is busy and the queue is full
+        """
+        if callback_url:
+            validate_callback_url(callback_url, self.allowed_callback_hosts)
+        if not self._slots.acquire(blocking=False):
+            with self._counts_lock:
+                self._counts["rejected"] += 1
+            raise QueueFullError("Analysis queue is full, retry later.")
+
+        try:
+            self.store.purge_if_due()
+            job_id = uuid.uuid4().hex
+            self.store.create(job_id, callback_url)
+            with self._counts_lock:
+                self._counts[QUEUED] += 1
+            self._executor.submit(self._run, job_id, payload, callback_url)
+        except Exception:
+            self._slots.release()
+            raise
+        return job_id
+
+    def _run(self, job_id, payload, callback_url):
+        self._transition(QUEUED, RUNNING)
+        try:
+            # Inside the try, so a failed write (e.g. database is locked) still frees the slot
+            self.store.update(job_id, RUNNING)
+            result = self.worker_fn(payload)
+            status = FAILED if "error" in result else COMPLETED
+            self.store.update(job_id, status, result=result, error=result.get("error"))
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            status = FAILED
+            self.store.update(job_id, status, error=str(e))
+        finally:
+            self._transition(RUNNING, status)
+            self._slots.release()
+
+        if callback_url:
+            self._callback_executor.submit(self._send_callback, job_id, callback_url)
+
+    def _transition(self, old, new):
+        with self._counts_lock:
+            self._counts[old] -= 1
+            self._counts[new] += 1
+
+    def _send_callback(self, job_id, callback_url):
+        """POST the finished job to the client's callback URL"""
+        body = json.dumps(self.store.get(job_id)).encode('utf-8')
+        callback = urllib.request.Request(callback_url, data=body, method='POST',
+                                          headers={'Content-Type': 'application/json'})
+        try:
+            # Checked again, since the host may resolve differently by the time the job finishes
+            validate_callback_url(callback_url, self.allowed_callback_hosts)
+            with _callback_opener.open(callback, timeout=self.callback_timeout):
+                pass
+        except Exception as e:
+            logger.warning(f"Callback for job {job_id} to {callback_url} failed: {str(e)}")
+
+    def stats(self):
+        """Counts of jobs by state since the queue started"""
+        with self._counts_lock:
+            return dict(self._counts, workers=self.workers, max_queued=self.max_queued)
+
+class InferenceExecutor:
+    """
+    Bounded pool of threads that run synchronous analyses for request handlers
+
+    Request threads hand the CPU-bound work to this pool and wait for it, so
+    only a fixed number of analyses run at once however many connections are
+    open, and light routes keep their threads free.
+    """
+
+    def __init__(self, workers=4, max_queued=32):
+        """
+        Initialize the executor
+
+        Args:
+            workers: Number of analyses run concurrently
+            max_queued: Analyses allowed to wait for a thread before requests are rejected
+        """
+        self.workers = workers
+        self.max_queued = max_queued
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+        self._counts_lock = threading.Lock()
+        self._counts = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0}
+
+    def run(self, fn, *args, timeout=None):
+        """
+        Run fn(*args) on an inference thread and wait for the result
+
+        Args:
+            fn: Callable to run
+            *args: Arguments passed to fn
+            timeout: Seconds to wait for the result (None waits indefinitely)
+
+        Returns:
+            Return value of fn
+
+        Raises:
+            QueueFullError: If every inference thread is busy and the queue is full
+            concurrent.futures.TimeoutError: If the result is not ready within timeout
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise QueueFullError("Server is busy, retry later.")
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the work finishes, even if the caller stops waiting
+        future.add_done_callback(self._finished)
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self._count("timed_out")
+            raise
+
+    def _finished(self, future):
+        self._slots.release()
+        self._count("failed" if future.exception() is not None else "completed")
+
+    def _count(self, key):
+        with self._counts_lock:
+            self._counts[key] += 1
+
+    def stats(self):
+        """Counts of analyses by outcome since the executor started"""
+        with self._counts_lock:
+            return dict(self._counts, workers=self.workers, max_queued=self.max_queued)
@@ -0,0 +1,34 @@
+import importlib
+import threading
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access
+
+    Lets modules such as analysis refer to tensorflow and cv2 at module level
+    without paying for the import until the first image is actually processed.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._module if self._module is not None else self._load()
+        return getattr(module, attr)
+
+    @property
+    def loaded(self):
+        """Whether the real module has been imported yet"""
+        return self._module is not None
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
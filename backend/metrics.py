@@ -0,0 +1,392 @@
+"""
+Lightweight timing and metrics for the analysis pipeline
+
+Counters, gauges and histograms kept in process memory and rendered in the
+Prometheus text exposition format for the /metrics endpoint. Set
+OCULARE_METRICS=0 to disable collection: every timer then returns a shared
+no-op context manager and every update returns immediately.
+
+Under a multi-worker server, set OCULARE_METRICS_DIR to a directory shared by
+the workers (gunicorn.conf.py does this). Each worker then writes its values
+there every few seconds, and /metrics reports their sum across all workers,
+including ones that have exited, whichever worker answers the scrape.
+"""
+import atexit
+import bisect
+import contextlib
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("OCULARE_METRICS", "1") == "1"
+
+# Analyses slower than this log their per-stage breakdown (0 disables)
+SLOW_ANALYSIS_MS = float(os.environ.get("OCULARE_SLOW_ANALYSIS_MS", "0"))
+
+# Latency buckets in seconds, from cached lookups up to full-resolution denoising
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Directory where each worker process of a multi-worker server keeps its values
+MULTIPROCESS_DIR = os.environ.get("OCULARE_METRICS_DIR") or None
+# Seconds between writes of this process's values to MULTIPROCESS_DIR
+FLUSH_INTERVAL = float(os.environ.get("OCULARE_METRICS_FLUSH_SECONDS", "5"))
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+def set_enabled(enabled):
+    """Turn collection on or off at runtime"""
+    global ENABLED
+    ENABLED = enabled
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _samples(self, values):
+        raise NotImplementedError
+
+    def snapshot(self):
+        """Copy of the current values as a list of [label values, value] pairs"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def _merge(self, value, other):
+        return value + other
+
+    def render(self, snapshots=None):
+        """
+        Render the metric's samples
+
+        Args:
+            snapshots: Snapshots of this metric from several processes to sum, or None
+                to render this process's values
+        """
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        values = {}
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                key = tuple(key)
+                values[key] = self._merge(values[key], value) if key in values else value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples(values))
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, values):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+class Gauge(_Metric):
+    """Value that goes up and down, such as requests in flight"""
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextlib.contextmanager
+    def _tracking(self, labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def track_in_progress(self, **labels):
+        """Context manager raising the gauge for the duration of the block"""
+        if not ENABLED:
+            return _NULL_CONTEXT
+        return self._tracking(labels)
+
+    def _samples(self, values):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, plus the +Inf overflow, sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of the block in seconds"""
+        if not ENABLED:
+            return _NULL_CONTEXT
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    def _merge(self, value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+
+    def _samples(self, values):
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed, **self.labels)
+        trace = getattr(_trace_local, "stages", None)
+        if trace is not None and "stage" in self.labels:
+            trace.append((self.labels["stage"], elapsed))
+
+REGISTRY = []
+
+def _snapshot_path(pid):
+    return os.path.join(MULTIPROCESS_DIR, f"{pid}.json")
+
+# Serializes snapshot writes from concurrent scrapes and the flusher thread
+_write_lock = threading.Lock()
+
+def _write_json_atomically(data, path):
+    """Write data to path through a unique temporary file, so readers never see a partial file"""
+    fd, partial = tempfile.mkstemp(dir=MULTIPROCESS_DIR, prefix="partial-", suffix=".json.tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(partial, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+
+def _write_snapshot():
+    """Write this process's values to MULTIPROCESS_DIR, replacing its previous snapshot"""
+    os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+    # Taken under the lock, so an older snapshot never replaces a newer one
+    with _write_lock:
+        snapshot = {metric.name: metric.snapshot() for metric in REGISTRY}
+        _write_json_atomically(snapshot, _snapshot_path(os.getpid()))
+
+def _read_snapshots(attempts=3):
+    """
+    Read every process's snapshot
+
+    A snapshot renamed by mark_process_dead between listing and reading would be
+    missed, making the sums drop, so the directory is read again in that case.
+    """
+    for _ in range(attempts):
+        snapshots = []
+        complete = True
+        for path in glob.glob(os.path.join(MULTIPROCESS_DIR, "*.json")):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                complete = False
+        if complete:
+            break
+    return snapshots
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    if MULTIPROCESS_DIR is None:
+        for metric in REGISTRY:
+            lines.extend(metric.render())
+    else:
+        # Sum over every worker, with this one's values as up to date as possible
+        try:
+            _write_snapshot()
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {MULTIPROCESS_DIR}: {str(e)}")
+        snapshots = _read_snapshots()
+        for metric in REGISTRY:
+            lines.extend(metric.render([snapshot.get(metric.name, []) for snapshot in snapshots]))
+    return "\n".join(lines) + "\n"
+
+_flusher = None
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            _write_snapshot()
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {MULTIPROCESS_DIR}: {str(e)}")
+
+def start_multiprocess_flush():
+    """
+    Start writing this process's values to MULTIPROCESS_DIR every FLUSH_INTERVAL seconds
+
+    Call in each worker process after it is forked; does nothing when
+    OCULARE_METRICS_DIR is not set.
+    """
+    global _flusher
+    if MULTIPROCESS_DIR is None or _flusher is not None:
+        return
+    _flusher = threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True)
+    _flusher.start()
+    atexit.register(_write_snapshot)
+
+def mark_process_dead(pid):
+    """
+    Keep an exited worker's counters and histograms but drop its gauges
+
+    Its snapshot is renamed, so a new worker that reuses the pid starts its own.
+    """
+    if MULTIPROCESS_DIR is None:
+        return
+    path = _snapshot_path(pid)
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    gauges = {metric.name for metric in REGISTRY if metric.kind == "gauge"}
+    snapshot = {name: values for name, values in snapshot.items() if name not in gauges}
+    # Drop the gauges in place, then rename, so no reader ever sees the values twice or partially
+    _write_json_atomically(snapshot, path)
+    os.replace(path, os.path.join(MULTIPROCESS_DIR, f"exited-{pid}-{time.time_ns()}.json"))
+
+def clear_multiprocess_dir():
+    """Remove the snapshots of a previous server run; call once per server start"""
+    if MULTIPROCESS_DIR is None:
+        return
+    os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(MULTIPROCESS_DIR, "*.json*")):
+        os.remove(path)
+
+# Per-thread list of (stage, seconds) for the analysis currently running
+_trace_local = threading.local()
+
+@contextlib.contextmanager
+def _tracing(name):
+    _trace_local.stages = stages = []
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _trace_local.stages = None
+        total_ms = (time.perf_counter() - start) * 1000.0
+        if total_ms >= SLOW_ANALYSIS_MS:
+            breakdown = ", ".join(f"{stage} {seconds * 1000.0:.1f} ms" for stage, seconds in stages)
+            logger.warning(f"Slow analysis of {name}: {total_ms:.1f} ms ({breakdown})")
+
+def trace(name):
+    """
+    Collect the stage timings of one analysis and log them if it is slow
+
+    Args:
+        name: Image name used in the log line
+
+    Returns:
+        Context manager wrapping the analysis
+    """
+    if not ENABLED or SLOW_ANALYSIS_MS <= 0:
+        return _NULL_CONTEXT
+    return _tracing(name)
+
+# Analysis pipeline
+ANALYSES = Counter("oculare_analyses_total", "Image analyses by outcome (ok, retake or error)", ["outcome"])
+ANALYSIS_SECONDS = Histogram("oculare_analysis_duration_seconds", "End-to-end duration of EyeDiseaseDetector.analyze")
+ANALYSES_IN_PROGRESS = Gauge("oculare_analyses_in_progress", "Analyses currently running")
+STAGE_SECONDS = Histogram("oculare_stage_duration_seconds",
+                          "Duration of each analysis stage (decode, quality, preprocess, prepare, predict, postprocess)",
+                          ["stage"])
+PREPROCESS_STEP_SECONDS = Histogram("oculare_preprocess_step_duration_seconds",
+                                    "Duration of each preprocessing step, excluding the steps it depends on",
+                                    ["step"])
+INFERENCE_SECONDS = Histogram("oculare_inference_duration_seconds", "Duration of one inference backend call",
+                              ["backend"])
+INFERENCE_BATCH_SIZE = Histogram("oculare_inference_batch_size", "Images per inference backend call",
+                                 buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+RESULT_CACHE_HITS = Counter("oculare_result_cache_hits_total", "Analyses answered from the result cache")
+REJECTED_SCANS = Counter("oculare_rejected_scans_total", "Images rejected by the quality gate, by reason",
+                         ["reason"])
+UNCERTAIN_PREDICTIONS = Counter("oculare_uncertain_predictions_total", "Predictions flagged as uncertain")
+
+# HTTP
+HTTP_REQUESTS = Counter("oculare_http_requests_total", "HTTP requests by route, method and status",
+                        ["route", "method", "status"])
+HTTP_REQUEST_SECONDS = Histogram("oculare_http_request_duration_seconds", "HTTP request duration by route",
+                                 ["route", "method"])
+INFERENCE_REJECTED = Counter("oculare_inference_rejected_total",
+                             "Synchronous analyses turned away because the inference executor was full")
+HTTP_IN_PROGRESS = Gauge("oculare_http_requests_in_progress", "HTTP requests currently being handled", ["route"])
@@ -0,0 +1,134 @@
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+# Fields returned to the app for each physician
+PHYSICIAN_FIELDS = ('name', 'disease', 'location', 'experience', 'biography')
+
+def normalize(value):
+    """Lower-case and collapse whitespace so lookups ignore formatting differences"""
+    return " ".join(value.lower().split())
+
+class _Snapshot:
+    """Immutable view of the directory, swapped in whole on reload"""
+
+    __slots__ = ("records", "pair_index", "disease_keys", "state_keys", "signature")
+
+    def __init__(self, records, pair_index, disease_keys, state_keys, signature):
+        self.records = records
+        self.pair_index = pair_index
+        self.disease_keys = disease_keys
+        self.state_keys = state_keys
+        self.signature = signature
+
+class PhysicianDirectory:
+    """In-memory physician directory indexed by disease and state"""
+
+    def __init__(self, file_path, check_interval=1.0):
+        """
+        Initialize the directory; the file is loaded on first lookup
+
+        Args:
+            file_path: Path to the JSON Lines physicians file
+            check_interval: Minimum seconds between checks for changes to the file
+        """
+        self.file_path = file_path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        stat = os.stat(self.file_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, signature):
+        """Parse the file and build the indexes"""
+        start = time.perf_counter()
+        entries = []
+        with open(self.file_path, 'r') as f:
+            for line in f:
+                try:
+                    physician = json.loads(line)
+                    record = tuple(physician[field] for field in PHYSICIAN_FIELDS)
+                    entries.append((normalize(physician['name']), record,
+                                    normalize(physician['disease']), normalize(physician['state'])))
+                except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                    continue
+
+        # Record ids follow name order, so merging posting lists yields sorted results
+        entries.sort(key=lambda entry: entry[0])
+
+        pair_index = {}
+        for record_id, (_, _, disease, state) in enumerate(entries):
+            pair_index.setdefault((disease, state), array('I')).append(record_id)
+
+        snapshot = _Snapshot(
+            records=[entry[1] for entry in entries],
+            pair_index=pair_index,
+            disease_keys=sorted({disease for disease, _ in pair_index}),
+            state_keys=sorted({state for _, state in pair_index}),
+            signature=signature
+        )
+        logger.info(f"Loaded {len(snapshot.records)} physicians from {self.file_path} "
+                    f"in {(time.perf_counter() - start) * 1000.0:.1f} ms")
+        return snapshot
+
+    def _current(self):
+        """Return the current snapshot, reloading it if the file changed"""
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._last_check < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            self._last_check = now
+            signature = self._file_signature()
+            if self._snapshot is None or self._snapshot.signature != signature:
+                self._snapshot = self._load(signature)
+            return self._snapshot
+
+    @staticmethod
+    def _matching_keys(keys, query):
+        """Every key containing the query, so a state of virginia also matches west virginia"""
+        if not query:
+            return keys
+        # Only distinct disease/state values are scanned, not every physician
+        return [key for key in keys if query in key]
+
+    def search(self, disease='', state='', limit=None, offset=0):
+        """
+        Find physicians whose disease and state contain the given text
+
+        Args:
+            disease: Disease text to match (empty matches all)
+            state: State text to match (empty matches all)
+            limit: Maximum number of results to return (None for all)
+            offset: Number of matching results to skip
+
+        Returns:
+            (total number of matches, list of physician dictionaries sorted by name)
+
+        Raises:
+            FileNotFoundError: If the physicians file does not exist
+        """
+        snapshot = self._current()
+        disease_keys = self._matching_keys(snapshot.disease_keys, normalize(disease))
+        state_keys = self._matching_keys(snapshot.state_keys, normalize(state))
+
+        postings = [snapshot.pair_index[(d, s)] for d in disease_keys for s in state_keys
+                    if (d, s) in snapshot.pair_index]
+        total = sum(len(posting) for posting in postings)
+
+        merged = postings[0] if len(postings) == 1 else heapq.merge(*postings)
+        stop = None if limit is None else offset + limit
+        page = islice(merged, offset, stop)
+
+        return total, [dict(zip(PHYSICIAN_FIELDS, snapshot.records[record_id])) for record_id in page]
@@ -0,0 +1,266 @@
+import atexit
+import logging
+import multiprocessing
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import analysis
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Per-process state of preprocessing workers, set up once by _init_worker
+_worker_state = {}
+
+def _init_worker(config, shm_name, slot_shape, num_slots):
+    """Attach the worker process to the shared tensor slots"""
+    # Each worker is single-threaded; the pool itself provides the parallelism
+    cv2.setNumThreads(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state["config"] = config
+    _worker_state["shm"] = shm
+    _worker_state["slots"] = np.ndarray((num_slots,) + slot_shape, dtype=np.float32, buffer=shm.buf)
+
+def _prepare_into_slot(source, slot):
+    """
+    Decode and preprocess one image, writing the model input into a shared slot
+
+    Args:
+        source: Path to the image file or encoded image bytes
+        slot: Index of the shared memory slot to fill
+
+    Returns:
+        (original image shape or None if unreadable, per-stage timings in seconds,
+        quality assessment or None if the quality gate is disabled); images that
+        fail the quality gate are not preprocessed and leave the slot untouched
+    """
+    config = _worker_state["config"]
+    timings = {}
+
+    start = time.perf_counter()
+    img, original_shape = analysis.load_image_source(source, config)
+    timings["decode"] = time.perf_counter() - start
+    if img is None:
+        return None, timings, None
+
+    quality = None
+    if analysis.quality_gate_enabled(config):
+        start = time.perf_counter()
+        quality = analysis.assess_image_quality(img, config)
+        timings["quality"] = time.perf_counter() - start
+        if not quality["acceptable"]:
+            return original_shape, timings, quality
+
+    # Variants are computed on first access, so build the model's input
+    # variant here to attribute its cost to this stage
+    start = time.perf_counter()
+    processed_img = analysis.preprocess_retinal_image(img, config)
+    processed_img["enhanced_color"]
+    timings["preprocess"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _worker_state["slots"][slot] = analysis.prepare_model_input(processed_img, config)[0]
+    timings["prepare"] = time.perf_counter() - start
+
+    return original_shape, timings, quality
+
+class PreprocessPool:
+    """Pool of worker processes that decode and preprocess images ahead of inference"""
+
+    def __init__(self, config, workers, prefetch=2):
+        """
+        Start the worker processes and allocate shared tensor slots
+
+        Args:
+            config: Model configuration dictionary
+            workers: Number of worker processes
+            prefetch: Images kept in flight per worker, so workers stay busy while the model runs
+        """
+        input_size = config["input_size"]
+        self.workers = workers
+        self.slot_shape = (input_size[1], input_size[0], 3)
+        self.num_slots = max(1, workers * prefetch)
+
+        # Prepared tensors come back through shared memory instead of being pickled
+        slot_bytes = int(np.prod(self.slot_shape)) * np.dtype(np.float32).itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=slot_bytes * self.num_slots)
+        self._slots = np.ndarray((self.num_slots,) + self.slot_shape, dtype=np.float32, buffer=self._shm.buf)
+
+        self._config = config
+        self._executor = self._start_executor()
+        # Slots are handed out per run, so one run at a time
+        self._run_lock = threading.Lock()
+        # Guards _running and _close_requested, so a close during a run waits for it to finish
+        self._state_lock = threading.Lock()
+        self._running = False
+        self._close_requested = False
+
+        self._stats_lock = threading.Lock()
+        self._stage_totals = defaultdict(float)
+        self._stage_counts = defaultdict(int)
+        self._closed = False
+        atexit.register(self.close)
+
+        logger.info(f"Preprocessing pool started with {workers} workers")
+
+    def _start_executor(self):
+        # Spawn keeps workers independent of threads already running in the parent
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self._config, self._shm.name, self.slot_shape, self.num_slots)
+        )
+
+    def _restart_executor(self):
+        """Replace a broken executor (one of its workers died) with a fresh set of workers"""
+        logger.warning("A preprocessing worker exited unexpectedly, restarting the pool")
+        # Also waits for the dead executor's processes to exit, so none still writes to a slot
+        self._executor.shutdown(wait=True)
+        self._executor = self._start_executor()
+
+    def record(self, stage, seconds, count=1):
+        """Add a timing sample for a pipeline stage"""
+        with self._stats_lock:
+            self._stage_totals[stage] += seconds
+            self._stage_counts[stage] += count
+
+    def imap(self, image_paths):
+        """
+        Decode and preprocess images in the worker processes
+
+        Up to num_slots images are in flight at once, so workers keep
+        preprocessing while the caller runs inference on earlier results.
+
+        Args:
+            image_paths: Iterable of image file paths, or of (name, source) pairs where
+                source is a path or encoded image bytes (bytes, bytearray or memoryview)
+
+        Yields:
+            (image_path, original shape or None, model-ready array or None, error message or None,
+            quality assessment or None) in input order; the array is None for images that
+            failed the quality gate
+        """
+        with self._run_lock:
+            with self._state_lock:
+                if self._closed:
+                    raise RuntimeError("Preprocessing pool is closed")
+                self._running = True
+            try:
+                yield from self._run(image_paths)
+            finally:
+                with self._state_lock:
+                    self._running = False
+                    close = self._close_requested
+                if close:
+                    self._shutdown()
+
+    def _run(self, image_paths):
+        """Body of imap, called with the run lock held"""
+        free_slots = deque(range(self.num_slots))
+        in_flight = deque()
+        paths = iter(image_paths)
+
+        def submit(source, slot):
+            try:
+                return self._executor.submit(_prepare_into_slot, source, slot)
+            except BrokenProcessPool:
+                # Items already in flight on the dead workers fail on their own below
+                self._restart_executor()
+                return self._executor.submit(_prepare_into_slot, source, slot)
+
+        def fill():
+            while free_slots:
+                item = next(paths, None)
+                if item is None:
+                    return
+                image_path, source = analysis.split_named_source(item)
+                if isinstance(source, (memoryview, bytearray)):
+                    # Uploads arrive as views of the request buffer, which cannot be pickled
+                    source = bytes(source)
+                slot = free_slots.popleft()
+                in_flight.append((image_path, slot, submit(source, slot)))
+
+        try:
+            fill()
+            while in_flight:
+                image_path, slot, future = in_flight.popleft()
+
+                start = time.perf_counter()
+                try:
+                    shape, timings, quality = future.result()
+                    error = None
+                except BrokenProcessPool:
+                    shape, timings, quality = None, {}, None
+                    error = "Preprocessing worker exited unexpectedly (the image may be too large)."
+                except Exception as e:
+                    shape, timings, quality, error = None, {}, None, str(e)
+                self.record("wait", time.perf_counter() - start)
+
+                for stage, seconds in timings.items():
+                    self.record(stage, seconds)
+                    metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+
+                accepted = shape is not None and (quality is None or quality["acceptable"])
+                img_array = self._slots[slot:slot + 1].copy() if accepted else None
+                free_slots.append(slot)
+                fill()
+
+                if error is None and shape is None:
+                    error = "Could not read the image."
+                yield image_path, shape, img_array, error, quality
+        finally:
+            # The caller stopped early: drop queued tasks and let running ones finish,
+            # so none of them writes into a slot the next run hands out again
+            for _, _, future in in_flight:
+                future.cancel()
+            wait([future for _, _, future in in_flight])
+
+    def stats(self):
+        """
+        Summarize per-stage timings
+
+        Returns:
+            Dictionary mapping stage name to sample count and mean/total milliseconds
+        """
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "stages": {
+                    stage: {
+                        "count": self._stage_counts[stage],
+                        "total_ms": total * 1000.0,
+                        "mean_ms": total * 1000.0 / self._stage_counts[stage] if self._stage_counts[stage] else 0.0
+                    }
+                    for stage, total in self._stage_totals.items()
+                }
+            }
+
+    def close(self):
+        """
+        Shut down the workers and release the shared memory
+
+        If a run is in progress, the pool is shut down when that run finishes
+        instead, so the thread iterating over it keeps its slots until then.
+        """
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._running:
+                self._close_requested = True
+                return
+        self._shutdown()
+
+    def _shutdown(self):
+        self._executor.shutdown(wait=True)
+        del self._slots
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def content_hash(data):
+    """Hex digest identifying an uploaded image by its bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+class ResultCache:
+    """Content-addressed cache of analysis results with an LRU memory tier and an optional disk tier"""
+
+    def __init__(self, namespace, max_memory_bytes=64 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        """
+        Initialize the cache
+
+        Args:
+            namespace: Identifies the model version and configuration; entries from
+                other namespaces are never returned and are purged from disk
+            max_memory_bytes: Size budget of the in-memory tier
+            disk_dir: Directory of the on-disk tier (None disables it)
+            max_disk_bytes: Size budget of the on-disk tier
+        """
+        self.namespace = namespace
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # Disk entries in least-recently-used order, key -> size in bytes
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def key(self, data):
+        """Cache key for an image's encoded bytes"""
+        return f"{self.namespace}-{content_hash(data)}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _scan_disk(self):
+        """Index the disk tier, dropping entries written by another model version or configuration"""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            if not name.startswith(f"{self.namespace}-"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len('.json')], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get(self, key):
+        """
+        Look up a cached result
+
+        Args:
+            key: Cache key from key()
+
+        Returns:
+            A fresh copy of the cached result dictionary, or None on a miss
+        """
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return json.loads(payload)
+
+            if key in self._disk:
+                try:
+                    with open(self._disk_path(key), 'rb') as f:
+                        payload = f.read()
+                except OSError:
+                    self._disk_bytes -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    os.utime(self._disk_path(key))
+                    self._stats["disk_hits"] += 1
+                    self._store_memory(key, payload)
+                    return json.loads(payload)
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, result):
+        """
+        Store an analysis result
+
+        Args:
+            key: Cache key from key()
+            result: JSON-serializable analysis result dictionary
+        """
+        payload = json.dumps(result).encode('utf-8')
+        with self._lock:
+            self._store_memory(key, payload)
+            if self.disk_dir:
+                self._store_disk(key, payload)
+
+    def _store_memory(self, key, payload):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = payload
+        self._memory_bytes += len(payload)
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._stats["evictions"] += 1
+
+    def _store_disk(self, key, payload):
+        # Write to a temporary file first so readers never see a partial entry
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            logger.warning(f"Could not write result cache entry: {str(e)}")
+            return
+
+        if key in self._disk:
+            self._disk_bytes -= self._disk.pop(key)
+        self._disk[key] = len(payload)
+        self._disk_bytes += len(payload)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._stats["evictions"] += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Drop every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            for key in list(self._disk):
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+            self._disk.clear()
+            self._disk_bytes = 0
+
+    def stats(self):
+        """
+        Summarize cache effectiveness
+
+        Returns:
+            Dictionary with hit/miss counts, hit rate and tier sizes
+        """
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_rate=hits / lookups if lookups else 0.0,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_entries=len(self._disk),
+                disk_bytes=self._disk_bytes
+            )
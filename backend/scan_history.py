@@ -0,0 +1,214 @@
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = ("day", "week", "month")
+
+def _bucket_key(timestamp, bucket):
+    """UTC calendar bucket of a timestamp: 2026-10-16, 2026-W42 or 2026-10"""
+    date = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).date()
+    if bucket == "day":
+        return date.isoformat()
+    if bucket == "week":
+        year, week, _ = date.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{date.year}-{date.month:02d}"
+
+class ScanHistory:
+    """
+    Append-only SQLite store of each user's analysis results
+
+    Every scan is stored as one compact row: the displayed and the raw model
+    disease probabilities as float32 blobs in the model's output order, plus
+    the model version, the image's content hash and the time of the scan. Rows are never updated,
+    and history and trend queries read them back without re-running the model.
+    """
+
+    def __init__(self, db_path, diseases):
+        """
+        Open (or create) the history database
+
+        Args:
+            db_path: Path to the SQLite file
+            diseases: Disease names in the order the probabilities are stored
+        """
+        self.db_path = db_path
+        self.diseases = list(diseases)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Appends only need to survive a crash of the process, not of the machine
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                content_hash TEXT,
+                model_version TEXT NOT NULL,
+                probabilities BLOB NOT NULL,
+                disease_detected INTEGER NOT NULL,
+                uncertain INTEGER NOT NULL,
+                raw_probabilities BLOB
+            )
+        """)
+        # Databases created before raw probabilities were kept; their old rows have none
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(scans)")}
+        if "raw_probabilities" not in columns:
+            self._conn.execute("ALTER TABLE scans ADD COLUMN raw_probabilities BLOB")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scans_user_created_at ON scans (user_id, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scans_created_at ON scans (created_at)")
+
+    def append(self, user_id, result, content_hash=None, created_at=None):
+        """
+        Record a completed analysis
+
+        Args:
+            user_id: User (patient) the scan belongs to
+            result: Analysis result dictionary with disease_probabilities and raw_probabilities
+            content_hash: Hash of the analyzed image bytes, if known
+            created_at: Scan time as a Unix timestamp (defaults to now)
+
+        Returns:
+            Id of the new scan
+        """
+        probabilities = self._pack(result["disease_probabilities"])
+        raw_probabilities = self._pack(result["raw_probabilities"]) if "raw_probabilities" in result else None
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO scans (user_id, created_at, content_hash, model_version, probabilities, "
+                "disease_detected, uncertain, raw_probabilities) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, created_at if created_at is not None else time.time(), content_hash,
+                 str(result.get("model_version")), probabilities,
+                 int(bool(result.get("disease_detected"))), int(bool(result.get("uncertain_prediction"))),
+                 raw_probabilities)
+            )
+            return cursor.lastrowid
+
+    def _pack(self, probabilities):
+        """Probabilities by disease name as a float32 blob in model output order"""
+        return np.array([probabilities.get(disease, 0.0) for disease in self.diseases], dtype=np.float32).tobytes()
+
+    def _range_clause(self, since, until):
+        clause, params = "", []
+        if since is not None:
+            clause += " AND created_at >= ?"
+            params.append(since)
+        if until is not None:
+            clause += " AND created_at < ?"
+            params.append(until)
+        return clause, params
+
+    def _decode(self, row):
+        scan_id, created_at, content_hash, model_version, blob, disease_detected, uncertain, raw_blob = row
+        probabilities = np.frombuffer(blob, dtype=np.float32)
+        raw_probabilities = np.frombuffer(raw_blob, dtype=np.float32) if raw_blob is not None else None
+        return {
+            "scan_id": scan_id,
+            "created_at": created_at,
+            "content_hash": content_hash,
+            "model_version": model_version,
+            "disease_probabilities": {disease: float(p) for disease, p in zip(self.diseases, probabilities)},
+            "raw_probabilities": ({disease: float(p) for disease, p in zip(self.diseases, raw_probabilities)}
+                                  if raw_probabilities is not None else None),
+            "most_likely_disease": self.diseases[int(np.argmax(probabilities))],
+            "disease_detected": bool(disease_detected),
+            "uncertain_prediction": bool(uncertain),
+        }
+
+    def history(self, user_id, limit=20, offset=0, since=None, until=None):
+        """
+        Page through a user's scans, newest first
+
+        Args:
+            user_id: User (patient) id
+            limit: Maximum scans returned
+            offset: Scans skipped
+            since: Only scans at or after this Unix timestamp
+            until: Only scans before this Unix timestamp
+
+        Returns:
+            (total number of matching scans, list of scan dictionaries)
+        """
+        clause, params = self._range_clause(since, until)
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM scans WHERE user_id = ?{clause}", [user_id] + params
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT id, created_at, content_hash, model_version, probabilities, disease_detected, uncertain, "
+                f"raw_probabilities FROM scans WHERE user_id = ?{clause} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                [user_id] + params + [limit, offset]
+            ).fetchall()
+        return total, [self._decode(row) for row in rows]
+
+    def trends(self, user_id, bucket="week", since=None, until=None):
+        """
+        Aggregate a user's scans per calendar bucket (UTC)
+
+        Args:
+            user_id: User (patient) id
+            bucket: "day", "week" or "month"
+            since: Only scans at or after this Unix timestamp
+            until: Only scans before this Unix timestamp
+
+        Returns:
+            Dictionary with the scan count and the per-disease mean and max
+            probability of each bucket (oldest first), and the change in mean
+            probability between the first and last bucket. Raw model probabilities
+            are used, or the displayed ones for scans recorded without them.
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket '{bucket}'. Expected one of {list(BUCKETS)}.")
+
+        clause, params = self._range_clause(since, until)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT created_at, COALESCE(raw_probabilities, probabilities), uncertain "
+                f"FROM scans WHERE user_id = ?{clause} ORDER BY created_at",
+                [user_id] + params
+            ).fetchall()
+
+        if not rows:
+            return {"user_id": user_id, "bucket": bucket, "scans": 0, "buckets": [], "change": None}
+
+        timestamps = [row[0] for row in rows]
+        probabilities = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        uncertain = np.array([row[2] for row in rows], dtype=bool)
+        keys = [_bucket_key(timestamp, bucket) for timestamp in timestamps]
+
+        buckets = []
+        start = 0
+        # Rows are in time order, so each bucket is a contiguous run
+        for end in range(1, len(rows) + 1):
+            if end < len(rows) and keys[end] == keys[start]:
+                continue
+            window = probabilities[start:end]
+            mean = window.mean(axis=0)
+            buckets.append({
+                "bucket": keys[start],
+                "scans": end - start,
+                "uncertain_scans": int(uncertain[start:end].sum()),
+                "mean_probabilities": {disease: float(p) for disease, p in zip(self.diseases, mean)},
+                "max_probabilities": {disease: float(p) for disease, p in zip(self.diseases, window.max(axis=0))},
+                "most_likely_disease": self.diseases[int(np.argmax(mean))],
+                "first_scan_at": timestamps[start],
+                "last_scan_at": timestamps[end - 1],
+            })
+            start = end
+
+        first, last = buckets[0]["mean_probabilities"], buckets[-1]["mean_probabilities"]
+        return {
+            "user_id": user_id,
+            "bucket": bucket,
+            "scans": len(rows),
+            "buckets": buckets,
+            "change": {disease: last[disease] - first[disease] for disease in self.diseases},
+        }
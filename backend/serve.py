@@ -0,0 +1,141 @@
+"""
+Production entry point for the Oculare API
+
+Serves server:app with gunicorn using gunicorn.conf.py: preforked worker
+processes that each load the model after they start, threaded request
+handling, HTTP keep-alive and a per-worker connection limit. Where gunicorn is not
+available (it does not run on Windows), waitress is used instead, as a
+single process with the same thread and connection limits.
+
+Settings come from the OCULARE_* environment variables read by
+gunicorn.conf.py, and the options below override them.
+
+Usage:
+    python serve.py
+    python serve.py --bind 0.0.0.0:8000 --workers 4 --threads 16
+    python serve.py --dev
+"""
+import argparse
+import importlib.util
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+GUNICORN_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+def run_gunicorn(options):
+    """
+    Run the app under gunicorn
+
+    Args:
+        options: Gunicorn settings overriding gunicorn.conf.py
+    """
+    from gunicorn.app.base import Application
+
+    class OculareApplication(Application):
+        def init(self, parser, opts, args):
+            return None
+
+        def load_config(self):
+            self.load_config_from_file(GUNICORN_CONFIG)
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import server
+            return server.app
+
+    OculareApplication().run()
+
+def run_waitress(options):
+    """
+    Run the app under waitress, in this process
+
+    Args:
+        options: Gunicorn-style settings (bind, threads, worker_connections, timeout)
+    """
+    from waitress import serve
+
+    import server
+    server.recover_interrupted_jobs()
+    if server.PRELOAD_MODEL:
+        # Single process, nothing is forked, so the model can load before serving
+        server.preload_model()
+
+    host, port = options["bind"].rsplit(':', 1)
+    # Waitress closes channels idle this long, including mid-body, so use the request timeout
+    # rather than the few seconds of keep-alive to give slow uploads time to arrive
+    serve(server.app, host=host, port=int(port), threads=options["threads"],
+          connection_limit=options["worker_connections"], channel_timeout=options["timeout"])
+
+def run_dev(bind):
+    """Run the Flask development server with the debugger and reloader"""
+    import server
+
+    # With the reloader, only the child process (WERKZEUG_RUN_MAIN) actually handles requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        server.recover_interrupted_jobs()
+        server.start_model_loading()
+    host, port = bind.rsplit(':', 1)
+    server.app.run(host=host, port=int(port), debug=True)
+
+def read_gunicorn_settings():
+    """
+    Read the settings gunicorn.conf.py defines, as defaults for either server
+
+    The config also sets gunicorn-only environment defaults (OCULARE_METRICS_DIR),
+    so the environment is restored afterwards: under waitress there is a single
+    process, and gunicorn sets them again when it loads the config itself.
+    """
+    settings = {}
+    environ = dict(os.environ)
+    try:
+        with open(GUNICORN_CONFIG) as f:
+            exec(compile(f.read(), GUNICORN_CONFIG, 'exec'), settings)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    return settings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Oculare API")
+    parser.add_argument('--bind', default=None, help="host:port (default: OCULARE_BIND or 0.0.0.0:5000)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: OCULARE_WORKERS or 2)")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="Request threads per worker (default: OCULARE_THREADS or 8)")
+    parser.add_argument('--server', choices=("auto", "gunicorn", "waitress"), default="auto")
+    parser.add_argument('--dev', action='store_true', help="Flask development server with the reloader")
+    args = parser.parse_args(argv)
+
+    if args.dev:
+        # Not preloaded: the model loads in the background while the dev server starts
+        run_dev(args.bind or os.environ.get("OCULARE_BIND", "0.0.0.0:5000"))
+        return
+
+    settings = read_gunicorn_settings()
+    options = {
+        "bind": args.bind or settings["bind"],
+        "workers": args.workers or settings["workers"],
+        "threads": args.threads or settings["threads"],
+        "worker_connections": settings["worker_connections"],
+        "keepalive": settings["keepalive"],
+        "timeout": settings["timeout"],
+    }
+
+    server_name = args.server
+    if server_name == "auto":
+        # gunicorn needs fcntl, so it cannot run where that module is missing (Windows)
+        if importlib.util.find_spec("gunicorn") is not None and importlib.util.find_spec("fcntl") is not None:
+            server_name = "gunicorn"
+        else:
+            logger.info("gunicorn is not available, serving with waitress in a single process")
+            server_name = "waitress"
+
+    if server_name == "gunicorn":
+        run_gunicorn(options)
+    else:
+        run_waitress(options)
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,534 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import datetime
+import io
+import logging
 import os
-import json  # Import json module to load JSON lines
+import threading
+import time
+import uuid
 import analysis
+import metrics
+from auth import AuthError, verify_token
+from jobs import CallbackURLError, InferenceExecutor, JobQueue, JobStore, QueueFullError
+from physicians import PhysicianDirectory
+from result_cache import content_hash
+from scan_history import BUCKETS, ScanHistory
+from streaming import VIDEO_EXTENSIONS, open_frames, video_file
+
+logger = logging.getLogger(__name__)
+
+class InMemoryUploadRequest(Request):
+    """Request that keeps uploaded files in memory instead of spooling large ones to temp files"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Safe because MAX_CONTENT_LENGTH bounds the whole request body
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("OCULARE_MAX_UPLOAD_MB", "25")) * 1024 * 1024
 CORS(app)
 
+# Uploads are analyzed in memory; set OCULARE_PERSIST_UPLOADS=1 to also keep a copy on disk
 UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+PERSIST_UPLOADS = os.environ.get("OCULARE_PERSIST_UPLOADS", "0") == "1"
+
+# Loaded on first lookup and reloaded automatically when the file changes
+physician_directory = PhysicianDirectory(os.path.join(os.path.dirname(__file__), 'physicians.txt'))
+
+# Background analysis jobs for /upload?async=1, created on first use
+JOB_DB_PATH = os.environ.get("OCULARE_JOB_DB", os.path.join(os.path.dirname(__file__), 'jobs.db'))
+JOB_WORKERS = int(os.environ.get("OCULARE_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("OCULARE_JOB_QUEUE_SIZE", "32"))
+# Callback hosts allowed even though they resolve to private addresses (comma-separated)
+CALLBACK_ALLOWED_HOSTS = [host.strip() for host in os.environ.get("OCULARE_CALLBACK_ALLOWED_HOSTS", "").split(',')
+                          if host.strip()]
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(
+                JobStore(JOB_DB_PATH),
+                lambda payload: analyze_and_record(*payload),
+                workers=JOB_WORKERS,
+                max_queued=JOB_QUEUE_SIZE,
+                allowed_callback_hosts=CALLBACK_ALLOWED_HOSTS
+            )
+        return _job_queue
+
+def recover_interrupted_jobs():
+    """Fail the jobs a previous server run left unfinished; call once per server start"""
+    store = JobStore(JOB_DB_PATH)
+    try:
+        count = store.fail_interrupted()
+    finally:
+        store.close()
+    if count:
+        logger.warning(f"Marked {count} jobs interrupted by the last shutdown as failed")
+
+# Synchronous analyses run on a dedicated pool: at most INFERENCE_WORKERS at once, with
+# INFERENCE_QUEUE_SIZE more waiting before uploads get a 429. Created on first use so its
+# threads start in each worker process, not in the master that forks them
+INFERENCE_WORKERS = int(os.environ.get("OCULARE_INFERENCE_WORKERS", "4"))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("OCULARE_INFERENCE_QUEUE_SIZE", "32"))
+INFERENCE_TIMEOUT = float(os.environ.get("OCULARE_INFERENCE_TIMEOUT", "60"))
+_inference_executor = None
+_inference_executor_lock = threading.Lock()
+
+def get_inference_executor():
+    global _inference_executor
+    with _inference_executor_lock:
+        if _inference_executor is None:
+            _inference_executor = InferenceExecutor(workers=INFERENCE_WORKERS, max_queued=INFERENCE_QUEUE_SIZE)
+        return _inference_executor
+
+# Results of scans uploaded with a user id, kept for /history; opened on first use
+HISTORY_DB_PATH = os.environ.get("OCULARE_HISTORY_DB", os.path.join(os.path.dirname(__file__), 'history.db'))
+_scan_history = None
+_scan_history_lock = threading.Lock()
+
+def get_scan_history():
+    global _scan_history
+    with _scan_history_lock:
+        if _scan_history is None:
+            # Same disease order as the model output, without loading the model
+            _scan_history = ScanHistory(HISTORY_DB_PATH, analysis.EyeDiseaseDetector.DISEASES)
+        return _scan_history
+
+# Supabase project JWT secret; access tokens are verified with it to identify the user
+JWT_SECRET = os.environ.get("OCULARE_JWT_SECRET") or os.environ.get("SUPABASE_JWT_SECRET")
+
+def authenticated_user_id():
+    """
+    User id of the request's access token (Authorization: Bearer <token>)
+
+    Returns:
+        The verified token's subject, or None if the request sends no token
+
+    Raises:
+        AuthError: If a token is sent but cannot be verified
+    """
+    header = request.headers.get('Authorization')
+    if not header:
+        return None
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        raise AuthError("Authorization header must be 'Bearer <access token>'")
+    if not JWT_SECRET:
+        raise AuthError("Authentication is not configured on this server")
+    return verify_token(token.strip(), JWT_SECRET)["sub"]
+
+def upload_user_id():
+    """
+    User id to record an upload's scan under
+    
+    Uploads are analyzed whatever their token: without a configured secret the
+    header is ignored, and a token that fails verification only means the scan
+    is not added to a history.
+    
+    Returns:
+        (user id or None, warning for the response or None)
+    """
+    if not JWT_SECRET:
+        return None, None
+    try:
+        return authenticated_user_id(), None
+    except AuthError as e:
+        logger.warning(f"Upload analyzed without recording it: {str(e)}")
+        return None, f"Scan not saved to history: {str(e)}"
+
+def authorize_history(user_id):
+    """Error response unless the request is authenticated as user_id, else None"""
+    current_user_id = authenticated_user_id()
+    if current_user_id is None:
+        raise AuthError("Authentication required")
+    if current_user_id != user_id:
+        return jsonify({"error": "Not allowed to access another user's history"}), 403
+    return None
+
+def record_scan(user_id, result, data=None):
+    """
+    Append a completed analysis to the user's scan history
+
+    Returns:
+        Id of the stored scan, or None if nothing was stored
+    """
+    if not user_id or "disease_probabilities" not in result:
+        return None
+    try:
+        return get_scan_history().append(user_id, result, content_hash=content_hash(data) if data is not None else None)
+    except Exception as e:
+        # A history failure must not cost the user their analysis
+        logger.error(f"Could not record scan for user {user_id}: {str(e)}")
+        return None
+
+def analyze_and_record(data, user_id=None):
+    """Analyze an uploaded image and add the result to the user's history (used by async jobs)"""
+    result = analysis.process_image(data, batching=True)
+    scan_id = record_scan(user_id, result, data)
+    return dict(result, scan_id=scan_id) if scan_id is not None else result
+
+def analyze_frames(source, frame_step=None, max_frames=None):
+    """Open a video or image sequence and analyze its frames (run on the inference executor)"""
+    detector = analysis.get_detector()
+    frames = open_frames(source, detector.config, frame_step=frame_step, max_frames=max_frames)
+    return detector.analyze_stream(frames)
+
+def parse_date(value):
+    """Parse an ISO date or datetime query parameter into a Unix timestamp (UTC unless an offset is given)"""
+    if value is None:
+        return None
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+def run_inference(fn, *args):
+    """Run an analysis on the inference executor, waiting at most INFERENCE_TIMEOUT seconds"""
+    return get_inference_executor().run(fn, *args, timeout=INFERENCE_TIMEOUT)
+
+# The model is loaded on first inference, in the background once /readyz is probed,
+# or as soon as each worker process starts with OCULARE_PRELOAD=1 (see gunicorn.conf.py)
+PRELOAD_MODEL = os.environ.get("OCULARE_PRELOAD", "0") == "1"
+_model_loader = None
+_model_load_error = None
+_model_loader_lock = threading.Lock()
+
+def preload_model():
+    """
+    Load and warm up the detector in this process
+    
+    Must run in the process that serves requests. Under a preforking server this
+    means after the fork (gunicorn.conf.py post_worker_init): TensorFlow's thread
+    pools and the TFLite/ONNX interpreters do not survive being forked.
+    """
+    analysis.get_detector(batching=True)
+
+def _load_model_in_background():
+    global _model_loader, _model_load_error
+    try:
+        analysis.get_detector(batching=True)
+        _model_load_error = None
+    except Exception as e:
+        logger.error(f"Background model load failed: {str(e)}")
+        _model_load_error = str(e)
+    finally:
+        with _model_loader_lock:
+            _model_loader = None
+
+def start_model_loading():
+    """Load the model on a background thread unless a load is already running"""
+    global _model_loader
+    with _model_loader_lock:
+        if _model_loader is None:
+            _model_loader = threading.Thread(target=_load_model_in_background, name="model-loader", daemon=True)
+            _model_loader.start()
+
+def read_upload(file):
+    """Return an uploaded file's bytes, without copying them if they are already in memory"""
+    stream = file.stream
+    if hasattr(stream, 'getbuffer'):
+        return stream.getbuffer()
+    return stream.read()
+
+def persist_upload(data, filename):
+    """Save a copy of an upload under a unique name (only when PERSIST_UPLOADS is enabled)"""
+    if not PERSIST_UPLOADS:
+        return None
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    file_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{secure_filename(filename or '') or 'upload'}")
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    return file_path
+
+# Request metrics; the hooks are not registered at all when metrics are disabled
+if metrics.ENABLED:
+    @app.before_request
+    def start_request_metrics():
+        # Label by route pattern (e.g. /jobs/<job_id>) so label values stay bounded
+        g.metrics_route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.metrics_start = time.perf_counter()
+        metrics.HTTP_IN_PROGRESS.inc(route=g.metrics_route)
+    
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_start' in g:
+            metrics.HTTP_REQUESTS.inc(route=g.metrics_route, method=request.method, status=str(response.status_code))
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start,
+                                                 route=g.metrics_route, method=request.method)
+        return response
+    
+    @app.teardown_request
+    def finish_request_metrics(error=None):
+        if 'metrics_route' in g:
+            metrics.HTTP_IN_PROGRESS.dec(route=g.metrics_route)
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({"error": f"Upload exceeds the {limit_mb} MB limit"}), 413
+
+@app.errorhandler(AuthError)
+def unauthorized(error):
+    response = jsonify({"error": str(error)})
+    response.headers['WWW-Authenticate'] = 'Bearer'
+    return response, 401
+
+@app.errorhandler(QueueFullError)
+def inference_busy(error):
+    metrics.INFERENCE_REJECTED.inc()
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = '5'
+    return response, 429
+
+@app.errorhandler(FutureTimeoutError)
+def inference_timeout(error):
+    # The analysis keeps its executor slot until it finishes, so new uploads are throttled meanwhile
+    response = jsonify({"error": "Analysis timed out, retry later."})
+    response.headers['Retry-After'] = '5'
+    return response, 503
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
+    if 'file' in request.files:
+        file = request.files['file']
+        filename = file.filename
+        data = read_upload(file)
+    elif request.mimetype.startswith('image/'):
+        # Raw image body, read straight from the request stream
+        filename = None
+        data = request.get_data(cache=False)
+    else:
         return jsonify({"error": "No file uploaded"}), 400
     
-    file = request.files['file']
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    if len(data) == 0:
+        return jsonify({"error": "Uploaded file is empty"}), 400
     
-    # Send image to analysis.py
-    result = analysis.process_image(file_path)
-
-    return jsonify({
+    # Only scans from an authenticated user are added to a history
+    user_id, history_warning = upload_user_id()
+    persist_upload(data, filename)
+    
+    if request.args.get('async') in ('1', 'true'):
+        callback_url = request.args.get('callback_url') or request.form.get('callback_url')
+        
+        try:
+            # Copy out of the request buffer, which is released when this request ends
+            job_id = get_job_queue().submit((bytes(data), user_id), callback_url=callback_url)
+        except CallbackURLError as e:
+            return jsonify({"error": str(e)}), 400
+        except QueueFullError as e:
+            response = jsonify({"error": str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+        
+        response = {
+            "message": "File uploaded successfully",
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}"
+        }
+        if history_warning is not None:
+            response["history_warning"] = history_warning
+        return jsonify(response), 202
+    
+    # Send image to analysis.py, decoding it from memory
+    # Concurrent uploads share model calls through the micro-batching queue
+    result = run_inference(lambda: analysis.process_image(data, batching=True))
+    
+    response = {
         "message": "File uploaded successfully",
         "analysis_result": result
-    })
+    }
+    scan_id = record_scan(user_id, result, data)
+    if scan_id is not None:
+        response["scan_id"] = scan_id
+    if history_warning is not None:
+        response["history_warning"] = history_warning
+    return jsonify(response)
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({"error": "No files uploaded"}), 400
+
+    user_id, history_warning = upload_user_id()
+    uploads = []
+    for file in files:
+        data = read_upload(file)
+        if len(data) > 0:
+            persist_upload(data, file.filename)
+        uploads.append((file.filename, data))
+
+    # Run the whole upload through batched inference instead of one model call per image;
+    # empty parts are answered here, as /upload does, instead of reaching the decoder
+    # The detector is looked up on the executor, so a model (re)load counts against its limits
+    analyzed = iter(run_inference(lambda: analysis.get_detector().analyze_batch(
+        [upload for upload in uploads if len(upload[1]) > 0])))
+    results = []
+    for _, data in uploads:
+        results.append(next(analyzed) if len(data) > 0 else {"error": "Uploaded file is empty"})
+
+    analysis_results = []
+    for index, result in enumerate(results):
+        # Results come back in upload order; pair each with its own upload's bytes
+        filename, data = uploads[index]
+        result.pop("image_path", None)
+        item = {"filename": os.path.basename(filename or ''), "analysis_result": result}
+        scan_id = record_scan(user_id, result, data)
+        if scan_id is not None:
+            item["scan_id"] = scan_id
+        analysis_results.append(item)
+
+    response = {
+        "message": f"{len(results)} files uploaded successfully",
+        "analysis_results": analysis_results
+    }
+    if history_warning is not None:
+        response["history_warning"] = history_warning
+    return jsonify(response)
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_stream():
+    frame_step = request.args.get('frame_step', type=int)
+    max_frames = request.args.get('max_frames', type=int)
+    if (frame_step is not None and frame_step < 1) or (max_frames is not None and max_frames < 1):
+        return jsonify({"error": "frame_step and max_frames must be positive integers"}), 400
+    
+    user_id, history_warning = upload_user_id()
+    
+    frame_files = request.files.getlist('frames')
+    if frame_files:
+        # Image sequence: frames are decoded one at a time as the stream is analyzed
+        result = run_inference(analyze_frames, (read_upload(file) for file in frame_files), frame_step, max_frames)
+    else:
+        if 'file' in request.files:
+            video = request.files['file']
+            extension = os.path.splitext(video.filename or '')[1].lower()
+            data = video.stream
+        elif request.mimetype.startswith('video/'):
+            extension = '.' + request.mimetype.split('/', 1)[1]
+            data = request.stream
+        else:
+            return jsonify({"error": "No video or frames uploaded"}), 400
+        
+        with video_file(data, suffix=extension if extension in VIDEO_EXTENSIONS else '.mp4') as path:
+            result = run_inference(analyze_frames, path, frame_step, max_frames)
+    
+    response = {
+        "message": "Stream uploaded successfully",
+        "analysis_result": result
+    }
+    # The frames are not kept, so there is no content hash for a stream
+    scan_id = record_scan(user_id, result)
+    if scan_id is not None:
+        response["scan_id"] = scan_id
+    if history_warning is not None:
+        response["history_warning"] = history_warning
+    return jsonify(response)
 
 @app.route('/physicians', methods=['GET'])
 def get_physicians():
-    disease = request.args.get('disease', '').lower()
-    state = request.args.get('state', '').lower()
+    disease = request.args.get('disease', '')
+    state = request.args.get('state', '')
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', 0, type=int)
 
-    file_path = os.path.join(os.path.dirname(__file__), 'physicians.txt')
+    if (limit is not None and limit < 0) or offset < 0:
+        return jsonify({"error": "limit and offset must be non-negative integers"}), 400
 
-    if not os.path.exists(file_path):
+    try:
+        total, physicians = physician_directory.search(disease, state, limit=limit, offset=offset)
+    except FileNotFoundError:
         return jsonify({"error": "physicians.txt file not found"}), 404
 
-    with open(file_path, 'r') as f:
-        raw_data = f.readlines()
+    response = jsonify(physicians)
+    response.headers['X-Total-Count'] = str(total)
+    return response
 
-    physicians = []
-    for line in raw_data:
-        try:
-            # Parse the line as a JSON object
-            physician = json.loads(line.strip())
-            # Check if the disease and state match
-            if (disease in physician["disease"].lower()) and (state in physician["state"].lower()):
-                physicians.append({
-                    'name': physician['name'],
-                    'disease': physician['disease'],
-                    'location': physician['location'],
-                    'experience': physician['experience'],
-                    'biography': physician['biography']
-                })
-        except json.JSONDecodeError:
-            continue
-
-    return jsonify(physicians)
+@app.route('/history/<user_id>', methods=['GET'])
+def get_history(user_id):
+    denied = authorize_history(user_id)
+    if denied is not None:
+        return denied
+    limit = request.args.get('limit', 20, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    if limit < 0 or offset < 0:
+        return jsonify({"error": "limit and offset must be non-negative integers"}), 400
+    try:
+        since, until = parse_date(request.args.get('since')), parse_date(request.args.get('until'))
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO dates (YYYY-MM-DD)"}), 400
+
+    total, scans = get_scan_history().history(user_id, limit=min(limit, 100), offset=offset, since=since, until=until)
+    response = jsonify(scans)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+@app.route('/history/<user_id>/trends', methods=['GET'])
+def get_history_trends(user_id):
+    denied = authorize_history(user_id)
+    if denied is not None:
+        return denied
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in BUCKETS:
+        return jsonify({"error": f"bucket must be one of {', '.join(BUCKETS)}"}), 400
+    try:
+        since, until = parse_date(request.args.get('since')), parse_date(request.args.get('until'))
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO dates (YYYY-MM-DD)"}), 400
+
+    return jsonify(get_scan_history().trends(user_id, bucket=bucket, since=since, until=until))
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue().store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: answers as soon as Flask is up, without touching the model
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    detector = analysis.peek_detector()
+    if detector is None or detector.backend is None:
+        start_model_loading()
+        # Each worker process loads its own model, so this only describes the worker that answered
+        body = {"status": "loading", "worker_pid": os.getpid()}
+        if _model_load_error is not None:
+            body["error"] = _model_load_error
+        return jsonify(body), 503
+    
+    return jsonify({
+        "status": "ready",
+        "worker_pid": os.getpid(),
+        "model_version": detector.version,
+        "inference_backend": detector.backend.name,
+        "load_time": detector.load_time,
+        "warmup_time": detector.warmup_time
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/model/stats', methods=['GET'])
+def model_stats():
+    stats = analysis.get_registry_stats()
+    if _inference_executor is not None:
+        stats["inference_executor"] = _inference_executor.stats()
+    return jsonify(stats)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Same as `python serve.py`; use `python serve.py --dev` for the debug server with the reloader
+    import serve
+    serve.main()
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Multi-frame fundus analysis for video bursts and image sequences
+
+Handheld fundus cameras record short bursts instead of single shots. Frames
+are decoded one at a time, blurry or dark frames are rejected by the same
+quality gate as single uploads (analysis.assess_image_quality), and the frames
+that pass are analyzed in batches by EyeDiseaseDetector.analyze_stream, which
+aggregates them into a single result. Only one batch of frames is held in
+memory at a time, however long the video is.
+
+Usage:
+    python streaming.py burst.mp4 --frame-step 2 --max-frames 300
+    python streaming.py frames_dir/
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import analysis
+from batch_analyze import collect_image_paths
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm', '.mpg', '.mpeg')
+
+def is_video(path):
+    return isinstance(path, str) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+def iter_video_frames(video_path, frame_step=1, max_frames=None):
+    """
+    Decode a video one frame at a time
+
+    Args:
+        video_path: Path to the video file
+        frame_step: Analyze every frame_step-th frame; skipped frames are not decoded
+        max_frames: Stop after this many frames have been yielded (None for no limit)
+
+    Yields:
+        (frame index, BGR frame) tuples
+    """
+    cv2 = analysis.cv2
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        logger.error(f"Could not open video {video_path}")
+        raise ValueError("Could not decode the video.")
+
+    try:
+        index = 0
+        yielded = 0
+        while max_frames is None or yielded < max_frames:
+            if index % frame_step:
+                # grab() advances without decoding the frame
+                if not capture.grab():
+                    break
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index, frame
+                yielded += 1
+            index += 1
+    finally:
+        capture.release()
+
+def iter_image_frames(sources, config, frame_step=1, max_frames=None):
+    """
+    Decode a sequence of images one at a time
+
+    Args:
+        sources: Iterable of image paths, encoded bytes or decoded arrays
+        config: Model configuration dictionary
+        frame_step: Analyze every frame_step-th image
+        max_frames: Stop after this many frames have been yielded (None for no limit)
+
+    Yields:
+        (frame index, BGR frame) tuples; unreadable images are skipped
+    """
+    yielded = 0
+    for index, source in enumerate(sources):
+        if max_frames is not None and yielded >= max_frames:
+            break
+        if index % frame_step:
+            continue
+        img, _ = analysis.load_image_source(source, config)
+        if img is None:
+            logger.warning(f"Skipping unreadable frame {index}")
+            continue
+        yield index, img
+        yielded += 1
+
+@contextlib.contextmanager
+def video_file(data, suffix='.mp4'):
+    """
+    Expose an uploaded video as a temporary file, which OpenCV needs to decode it
+
+    Args:
+        data: Encoded video bytes, or a binary stream copied to disk in chunks
+        suffix: File extension hinting the container format
+
+    Yields:
+        Path of the temporary file, deleted on exit
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if hasattr(data, 'read'):
+                shutil.copyfileobj(data, f)
+            else:
+                f.write(data)
+        yield path
+    finally:
+        os.remove(path)
+
+def open_frames(source, config, frame_step=None, max_frames=None):
+    """
+    Iterate over the frames of a video file, a directory of images or a list of images
+
+    Args:
+        source: Video path, directory path, or list of image paths/bytes/arrays
+        config: Model configuration dictionary
+        frame_step: Analyze every frame_step-th frame (defaults to config)
+        max_frames: Maximum frames analyzed (defaults to config)
+
+    Returns:
+        Iterator of (frame index, BGR frame) tuples
+    """
+    streaming_config = config.get("streaming", {})
+    if frame_step is None:
+        frame_step = streaming_config.get("frame_step", 1)
+    if max_frames is None:
+        max_frames = streaming_config.get("max_frames", 600)
+    frame_step = max(1, int(frame_step))
+
+    if is_video(source):
+        return iter_video_frames(source, frame_step=frame_step, max_frames=max_frames)
+    if isinstance(source, str):
+        source = collect_image_paths([source])
+    return iter_image_frames(source, config, frame_step=frame_step, max_frames=max_frames)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a fundus video burst or image sequence as one examination")
+    parser.add_argument('source', help="Video file or directory of frames")
+    parser.add_argument('--frame-step', type=int, default=None, help="Analyze every N-th frame")
+    parser.add_argument('--max-frames', type=int, default=None, help="Maximum frames analyzed")
+    parser.add_argument('--model-path', default=analysis.DEFAULT_MODEL_PATH)
+    parser.add_argument('--config-path', default=analysis.DEFAULT_CONFIG_PATH)
+    args = parser.parse_args(argv)
+
+    detector = analysis.get_detector(model_path=args.model_path, config_path=args.config_path)
+    frames = open_frames(args.source, detector.config, frame_step=args.frame_step, max_frames=args.max_frames)
+    result = detector.analyze_stream(frames)
+    print(json.dumps(result, indent=2))
+    return result
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+tf.data input pipeline for training the eye disease model
+
+Reads fundus images from a directory with one subdirectory per disease
+(e.g. data/train/glaucoma/*.jpg) and runs them through the same
+preprocessing as inference (analysis.preprocess_retinal_image and
+analysis.prepare_model_input), so the model is trained on exactly the inputs
+it will see when serving. Images are preprocessed in parallel, the prepared
+tensors can be cached in memory, in a cache file or as TFRecord shards so
+later epochs and runs skip decoding and preprocessing, and batches are
+shuffled and prefetched while the model trains. Training throughput is
+logged in images/sec.
+
+Usage:
+    python training.py data/train --validation data/val --epochs 50 --cache cache/ --shards 16 --mixed-precision
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import analysis
+from batch_analyze import collect_image_paths
+
+logger = logging.getLogger(__name__)
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+def _normalize_class_name(name):
+    return name.lower().replace('_', ' ').replace('-', ' ').strip()
+
+def collect_labeled_images(data_dir, class_names):
+    """
+    List the images of a directory laid out as data_dir/<disease>/<image>
+
+    Subdirectory names are matched to class_names case-insensitively, with
+    underscores or dashes standing in for spaces (diabetic_retinopathy).
+
+    Args:
+        data_dir: Root directory of the labeled images
+        class_names: Disease names in model output order
+
+    Returns:
+        (list of image paths, list of class indices)
+    """
+    class_indices = {_normalize_class_name(name): i for i, name in enumerate(class_names)}
+
+    paths, labels = [], []
+    for entry in sorted(os.listdir(data_dir)):
+        class_dir = os.path.join(data_dir, entry)
+        if not os.path.isdir(class_dir):
+            continue
+        index = class_indices.get(_normalize_class_name(entry))
+        if index is None:
+            logger.warning(f"Skipping {class_dir}: not one of {class_names}")
+            continue
+        class_paths = collect_image_paths([class_dir])
+        paths.extend(class_paths)
+        labels.extend([index] * len(class_paths))
+        logger.info(f"{class_names[index]}: {len(class_paths)} images")
+
+    if not paths:
+        raise ValueError(f"No labeled images found in {data_dir}")
+    return paths, labels
+
+def split_validation(paths, labels, fraction, seed=0):
+    """
+    Hold out a random fraction of the images for validation
+
+    Returns:
+        ((train paths, train labels), (validation paths, validation labels))
+    """
+    order = list(range(len(paths)))
+    random.Random(seed).shuffle(order)
+    held_out = set(order[:int(len(order) * fraction)])
+    train = [i for i in range(len(paths)) if i not in held_out]
+    validation = sorted(held_out)
+    return (([paths[i] for i in train], [labels[i] for i in train]),
+            ([paths[i] for i in validation], [labels[i] for i in validation]))
+
+def _prepare_image(path, config):
+    """Decode and preprocess one image exactly as inference does, flagging unreadable files"""
+    input_size = config["input_size"]
+    img, _ = analysis.load_image(path.decode('utf-8'), config)
+    if img is None:
+        logger.warning(f"Skipping unreadable training image {path.decode('utf-8')}")
+        return np.zeros((input_size[1], input_size[0], 3), dtype=np.float32), False
+    img_array = analysis.prepare_model_input(analysis.preprocess_retinal_image(img, config), config)
+    return img_array[0].astype(np.float32), True
+
+def preprocessed_dataset(paths, labels, config, num_classes, shuffle=False, seed=None):
+    """
+    Build an unbatched dataset of (model input, one-hot label) pairs
+
+    Preprocessing runs in OpenCV, which releases the GIL, so the parallel
+    map spreads it over all cores.
+
+    Args:
+        paths: Image file paths
+        labels: Class index of each image
+        config: Model configuration dictionary
+        num_classes: Number of diseases
+        shuffle: Shuffle the file order every epoch (cheap, before preprocessing)
+        seed: Shuffle seed
+
+    Returns:
+        tf.data.Dataset
+    """
+    input_size = config["input_size"]
+    image_shape = (input_size[1], input_size[0], 3)
+
+    def load(path, label):
+        image, ok = tf.numpy_function(lambda p: _prepare_image(p, config), [path], (tf.float32, tf.bool))
+        image.set_shape(image_shape)
+        return image, tf.one_hot(label, num_classes), ok
+
+    def readable(image, label, ok):
+        return ok
+
+    def drop_flag(image, label, ok):
+        return image, label
+
+    dataset = tf.data.Dataset.from_tensor_slices((list(paths), np.asarray(labels, dtype=np.int32)))
+    if shuffle:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(load, num_parallel_calls=AUTOTUNE, deterministic=False)
+    return dataset.filter(readable).map(drop_flag)
+
+def cache_fingerprint(paths, labels, config):
+    """
+    Identify a set of preprocessed tensors, so a cache is only reused for the
+    same files, labels and preprocessing configuration
+    """
+    keys = ("input_size", "normalization_method", "preprocessing")
+    signature = json.dumps({
+        "config": {key: config.get(key) for key in keys},
+        "files": [(path, label, analysis._file_signature(path)) for path, label in zip(paths, labels)],
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(signature.encode('utf-8')).hexdigest()[:16]
+
+def write_shards(dataset, shard_dir, num_shards):
+    """
+    Write an unbatched (model input, one-hot label) dataset as TFRecord shards
+
+    Returns:
+        Number of examples written
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_paths = [os.path.join(shard_dir, f"shard-{i:05d}-of-{num_shards:05d}.tfrecord") for i in range(num_shards)]
+    writers = [tf.io.TFRecordWriter(path) for path in shard_paths]
+    count = 0
+    try:
+        for image, label in dataset:
+            example = tf.train.Example(features=tf.train.Features(feature={
+                "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[tf.io.serialize_tensor(image).numpy()])),
+                "label": tf.train.Feature(float_list=tf.train.FloatList(value=label.numpy())),
+            }))
+            writers[count % num_shards].write(example.SerializeToString())
+            count += 1
+    finally:
+        for writer in writers:
+            writer.close()
+    return count
+
+def read_shards(shard_dir, config, num_classes, shuffle=False, seed=None):
+    """
+    Read TFRecord shards written by write_shards, interleaving the shard files
+
+    Returns:
+        Unbatched tf.data.Dataset of (model input, one-hot label) pairs
+    """
+    input_size = config["input_size"]
+    image_shape = (input_size[1], input_size[0], 3)
+    features = {
+        "image": tf.io.FixedLenFeature([], tf.string),
+        "label": tf.io.FixedLenFeature([num_classes], tf.float32),
+    }
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, features)
+        image = tf.io.parse_tensor(example["image"], tf.float32)
+        image.set_shape(image_shape)
+        return image, example["label"]
+
+    files = tf.data.Dataset.list_files(os.path.join(shard_dir, "*.tfrecord"), shuffle=shuffle, seed=seed)
+    dataset = files.interleave(tf.data.TFRecordDataset, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    return dataset.map(parse, num_parallel_calls=AUTOTUNE)
+
+def build_dataset(paths, labels, config, num_classes, batch_size=32, training=True, cache=None, num_shards=0,
+                  shuffle_buffer=512, seed=None):
+    """
+    Build a batched, prefetched training or validation dataset
+
+    Args:
+        paths: Image file paths
+        labels: Class index of each image
+        config: Model configuration dictionary
+        num_classes: Number of diseases
+        batch_size: Images per batch
+        training: Shuffle every epoch (validation data is read in order)
+        cache: None, "memory", or a directory for cached preprocessed tensors
+        num_shards: With a cache directory, store the tensors as this many TFRecord
+            shards instead of a tf.data cache file
+        shuffle_buffer: Preprocessed images held for shuffling when reading a cache
+        seed: Shuffle seed
+
+    Returns:
+        tf.data.Dataset of (batch of model inputs, batch of one-hot labels)
+    """
+    if cache is None:
+        # Nothing is cached, so shuffling file names is enough and costs no memory
+        dataset = preprocessed_dataset(paths, labels, config, num_classes, shuffle=training, seed=seed)
+    elif cache == "memory":
+        dataset = preprocessed_dataset(paths, labels, config, num_classes).cache()
+    else:
+        cache_path = os.path.join(cache, cache_fingerprint(paths, labels, config))
+        if num_shards:
+            # Shards are written under a temporary name, so an interrupted run is never mistaken for a cache
+            if not os.path.isdir(cache_path):
+                start = time.perf_counter()
+                count = write_shards(preprocessed_dataset(paths, labels, config, num_classes), cache_path + ".partial",
+                                     num_shards)
+                os.replace(cache_path + ".partial", cache_path)
+                logger.info(f"Cached {count} preprocessed images as {num_shards} shards in {cache_path} "
+                            f"({count / (time.perf_counter() - start):.1f} images/sec)")
+            dataset = read_shards(cache_path, config, num_classes, shuffle=training, seed=seed)
+        else:
+            os.makedirs(cache, exist_ok=True)
+            dataset = preprocessed_dataset(paths, labels, config, num_classes).cache(cache_path)
+
+    if training and cache is not None:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(AUTOTUNE)
+
+def enable_mixed_precision(policy="mixed_float16"):
+    """
+    Compute in float16 (or bfloat16) while keeping float32 weights
+
+    Must be called before the model is created; the output layer of
+    EyeDiseaseDetector stays float32 so the softmax is numerically stable.
+    """
+    tf.keras.mixed_precision.set_global_policy(policy)
+    logger.info(f"Mixed precision policy: {policy}")
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Log training throughput in images/sec, adding it to the epoch logs as images_per_sec"""
+
+    def __init__(self, batch_size, num_images=None, log_every=50):
+        """
+        Args:
+            batch_size: Images per batch
+            num_images: Training images per epoch, for an exact per-epoch rate
+            log_every: Log the running rate every this many batches (0 to disable)
+        """
+        super().__init__()
+        self.batch_size = batch_size
+        self.num_images = num_images
+        self.log_every = log_every
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._batches = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._batches += 1
+        if self.log_every and self._batches % self.log_every == 0:
+            rate = self._batches * self.batch_size / (time.perf_counter() - self._epoch_start)
+            logger.info(f"Batch {self._batches}: {rate:.1f} images/sec")
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._epoch_start
+        images = self.num_images if self.num_images is not None else self._batches * self.batch_size
+        rate = images / elapsed if elapsed else 0.0
+        if logs is not None:
+            logs["images_per_sec"] = rate
+        logger.info(f"Epoch {epoch + 1}: {images} images in {elapsed:.1f}s ({rate:.1f} images/sec)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the eye disease model on labeled image directories")
+    parser.add_argument('train_dir', help="Directory with one subdirectory of images per disease")
+    parser.add_argument('--validation', default=None, help="Validation directory laid out like train_dir")
+    parser.add_argument('--validation-split', type=float, default=0.2,
+                        help="Fraction of train_dir held out when --validation is not given")
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--cache', default=None, help="'memory' or a directory for preprocessed tensors")
+    parser.add_argument('--shards', type=int, default=0, help="Cache as this many TFRecord shards")
+    parser.add_argument('--shuffle-buffer', type=int, default=512)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mixed-precision', action='store_true', help="Train with the mixed_float16 policy")
+    parser.add_argument('--model-path', default=analysis.DEFAULT_MODEL_PATH)
+    parser.add_argument('--config-path', default=analysis.DEFAULT_CONFIG_PATH)
+    args = parser.parse_args(argv)
+
+    if args.shards and (args.cache is None or args.cache == "memory"):
+        parser.error("--shards needs a cache directory")
+    if args.mixed_precision:
+        enable_mixed_precision()
+
+    detector = analysis.EyeDiseaseDetector(model_path=args.model_path, config_path=args.config_path)
+    num_classes = len(detector.diseases)
+
+    paths, labels = collect_labeled_images(args.train_dir, detector.diseases)
+    if args.validation:
+        validation_paths, validation_labels = collect_labeled_images(args.validation, detector.diseases)
+    else:
+        (paths, labels), (validation_paths, validation_labels) = split_validation(paths, labels,
+                                                                                  args.validation_split, args.seed)
+    if not validation_paths:
+        parser.error("No validation images; pass --validation or a larger --validation-split")
+    logger.info(f"Training on {len(paths)} images, validating on {len(validation_paths)}")
+
+    options = dict(config=detector.config, num_classes=num_classes, batch_size=args.batch_size, cache=args.cache,
+                   num_shards=args.shards, shuffle_buffer=args.shuffle_buffer, seed=args.seed)
+    train_data = build_dataset(paths, labels, training=True, **options)
+    validation_data = build_dataset(validation_paths, validation_labels, training=False, **options)
+
+    history = detector.train(train_data, validation_data, epochs=args.epochs, batch_size=args.batch_size,
+                             callbacks=[ThroughputCallback(args.batch_size, num_images=len(paths))])
+    return history
+
+if __name__ == '__main__':
+    main()